@@ -1,25 +1,90 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+from os import PathLike
+from pathlib import Path
 from typing import Any
+from typing import Dict
+from typing import List
 from zipfile import ZipFile
 
 import geopandas as gpd
+import numpy as np
 import pandera
 from pandera import DataFrameSchema, Column, Check, Index
 import pandas as pd
 
 
-def concatenate_local_authority_floor_areas(upstream: Any, product: Any) -> None:
-    dcc = pd.read_excel(upstream["download_valuation_office_floor_areas_dcc"])
-    dlrcc = pd.read_excel(upstream["download_valuation_office_floor_areas_dlrcc"])
-    sdcc = pd.read_excel(upstream["download_valuation_office_floor_areas_sdcc"])
-    fcc = pd.read_excel(upstream["download_valuation_office_floor_areas_fcc"])
-    dublin = pd.concat([dcc, dlrcc, sdcc, fcc])
-    dublin.to_csv(product, index=False)
+def _get_content_hash(filepath: PathLike) -> str:
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _stringify_object_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # a column can hold both text & numbers which parquet can't store, so these are
+    # stored as text as they would be if read back from csv
+    object_columns = df.select_dtypes("object").columns
+    df[object_columns] = df[object_columns].apply(
+        lambda s: s.where(s.isnull(), s.astype(str))
+    )
+    return df
+
+
+def _parse_floor_areas(filepath: PathLike, cache_filepath: Path) -> None:
+    floor_areas = _stringify_object_columns(pd.read_excel(filepath))
+    # write then rename so an interrupted write is never mistaken for a cache
+    partial_filepath = cache_filepath.with_suffix(".partial")
+    floor_areas.to_parquet(partial_filepath, index=False)
+    partial_filepath.rename(cache_filepath)
+
+
+def concatenate_local_authority_floor_areas(
+    upstream: Any, product: Any, cache_dirpath: str, n_workers: int
+) -> None:
+    filepaths = [
+        Path(upstream["download_valuation_office_floor_areas_dcc"]),
+        Path(upstream["download_valuation_office_floor_areas_dlrcc"]),
+        Path(upstream["download_valuation_office_floor_areas_sdcc"]),
+        Path(upstream["download_valuation_office_floor_areas_fcc"]),
+    ]
+
+    # parsed workbooks are cached by content so an unchanged workbook is never
+    # parsed again, & caches of its previous contents are removed
+    cache_dirpath = Path(cache_dirpath)
+    cache_dirpath.mkdir(parents=True, exist_ok=True)
+    cache_filepaths = [
+        cache_dirpath / f"{filepath.stem}-{_get_content_hash(filepath)}.parquet"
+        for filepath in filepaths
+    ]
+    for filepath, cache_filepath in zip(filepaths, cache_filepaths):
+        for stale_filepath in cache_dirpath.glob(f"{filepath.stem}-*.parquet"):
+            if stale_filepath != cache_filepath:
+                stale_filepath.unlink()
+
+    uncached = [
+        (filepath, cache_filepath)
+        for filepath, cache_filepath in zip(filepaths, cache_filepaths)
+        if not cache_filepath.exists()
+    ]
+    if uncached:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(_parse_floor_areas, *zip(*uncached)))
+
+    # a column typed differently by different workbooks (e.g. empty in one & text in
+    # another) is mixed once concatenated, so is stored as text like the workbooks
+    dublin = pd.concat(
+        [pd.read_parquet(cache_filepath) for cache_filepath in cache_filepaths],
+        ignore_index=True,
+    )
+    _stringify_object_columns(dublin).to_parquet(product, index=False)
 
 
 def validate_dublin_floor_areas(product: Any) -> None:
-    dublin_floor_areas = pd.read_csv(product)
+    dublin_floor_areas = pd.read_parquet(product)
     schema = DataFrameSchema(
         columns={
             "PropertyNo": Column(
@@ -225,10 +290,8 @@ def weather_adjust_benchmarks(upstream: Any, product: Any) -> None:
     normalised_benchmarks.to_csv(product, index=False)
 
 
-def replace_unexpectedly_large_floor_areas_with_typical_values(
-    upstream: Any, product: Any
-) -> None:
-    buildings = pd.read_csv(upstream["concatenate_local_authority_floor_areas"])
+def link_floor_areas_to_benchmarks(upstream: Any, product: Any) -> None:
+    buildings = pd.read_parquet(upstream["concatenate_local_authority_floor_areas"])
     benchmarks = pd.read_csv(upstream["weather_adjust_benchmarks"])
     with open(upstream["convert_benchmark_uses_to_json"], "r") as f:
         benchmark_uses = json.load(f)
@@ -238,9 +301,8 @@ def replace_unexpectedly_large_floor_areas_with_typical_values(
     )
     buildings_with_benchmarks = buildings.merge(benchmarks)
 
+    # Replace invalid floor areas with typical values
     bounded_area_m2 = buildings_with_benchmarks["Total_SQM"].rename("bounded_area_m2")
-    typical_area = buildings_with_benchmarks["typical_area_m2"]
-
     greater_than_zero_floor_area = buildings_with_benchmarks["Total_SQM"] > 0
     greater_than_typical_benchmark_upper_bound = (
         buildings_with_benchmarks["Total_SQM"]
@@ -252,27 +314,30 @@ def replace_unexpectedly_large_floor_areas_with_typical_values(
         & greater_than_typical_benchmark_upper_bound
         & valid_benchmark
     )
-    bounded_area_m2.loc[area_is_greater_than_expected] = typical_area.loc[
-        area_is_greater_than_expected
-    ]
+    bounded_area_m2.loc[area_is_greater_than_expected] = buildings_with_benchmarks[
+        "typical_area_m2"
+    ].loc[area_is_greater_than_expected]
+    buildings_with_benchmarks["bounded_area_m2"] = bounded_area_m2
 
-    propertyno_bounded_area_map = pd.concat(
-        [buildings["PropertyNo"], bounded_area_m2], axis=1
+    buildings_with_benchmarks.astype({"Benchmark": "category"}).to_parquet(
+        product, index=False
     )
 
-    propertyno_bounded_area_map.to_csv(product, index=False)
+
+def replace_unexpectedly_large_floor_areas_with_typical_values(
+    upstream: Any, product: Any
+) -> None:
+    buildings_with_benchmarks = pd.read_parquet(
+        upstream["link_floor_areas_to_benchmarks"],
+        columns=["PropertyNo", "bounded_area_m2"],
+    )
+    buildings_with_benchmarks.to_csv(product, index=False)
 
 
 def save_unknown_benchmark_uses(upstream: Any, product: Any) -> None:
-    buildings = pd.read_csv(upstream["concatenate_local_authority_floor_areas"])
-    benchmarks = pd.read_csv(upstream["weather_adjust_benchmarks"])
-    with open(upstream["convert_benchmark_uses_to_json"], "r") as f:
-        benchmark_uses = json.load(f)
-
-    buildings["Benchmark"] = (
-        buildings["Use1"].map(benchmark_uses).rename("Benchmark").fillna("Unknown")
+    buildings_with_benchmarks = pd.read_parquet(
+        upstream["link_floor_areas_to_benchmarks"], columns=["Use1", "Benchmark"]
     )
-    buildings_with_benchmarks = buildings.merge(benchmarks)
 
     benchmark_is_unknown = buildings_with_benchmarks["Benchmark"] == "Unknown"
     unknown_benchmark_uses = pd.Series(
@@ -282,90 +347,35 @@ def save_unknown_benchmark_uses(upstream: Any, product: Any) -> None:
     unknown_benchmark_uses.to_csv(product, index=False)
 
 
-def apply_energy_benchmarks_to_floor_areas(
-    upstream: Any, product: Any, boiler_efficiency: float
-) -> None:
-
-    buildings = pd.read_csv(upstream["concatenate_local_authority_floor_areas"])
-    benchmarks = pd.read_csv(upstream["weather_adjust_benchmarks"])
-    with open(upstream["convert_benchmark_uses_to_json"], "r") as f:
-        benchmark_uses = json.load(f)
-
-    buildings["Benchmark"] = (
-        buildings["Use1"].map(benchmark_uses).rename("Benchmark").fillna("Unknown")
-    )
-    buildings_with_benchmarks = buildings.merge(benchmarks)
-
-    # Replace invalid floor areas with typical values
-    bounded_area_m2 = buildings_with_benchmarks["Total_SQM"].rename("bounded_area_m2")
-    greater_than_zero_floor_area = buildings_with_benchmarks["Total_SQM"] > 0
-    greater_than_typical_benchmark_upper_bound = (
-        buildings_with_benchmarks["Total_SQM"]
-        > buildings_with_benchmarks["area_upper_bound_m2"]
-    )
-    valid_benchmark = ~buildings_with_benchmarks["Benchmark"].isin(["Unknown", "None"])
-    area_is_greater_than_expected = (
-        greater_than_zero_floor_area
-        & greater_than_typical_benchmark_upper_bound
-        & valid_benchmark
-    )
-    bounded_area_m2.loc[area_is_greater_than_expected] = buildings_with_benchmarks[
-        "typical_area_m2"
-    ].loc[area_is_greater_than_expected]
-    buildings_with_benchmarks["bounded_area_m2"] = bounded_area_m2
-
-    # Apply Benchmarks
+def _estimate_end_use_demands(
+    buildings_with_benchmarks: pd.DataFrame, end_uses: List[Dict[str, Any]]
+) -> np.ndarray:
+    # every end use is area * benchmark intensity * efficiency factor, so all are
+    # computed in place in one (buildings x end uses) matrix of intensities
     kwh_to_mwh = 1e-3
-    buildings_with_benchmarks["electricity_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_electricity_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
-    ).fillna(0)
-    buildings_with_benchmarks["fossil_fuel_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_fossil_fuel_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
-        * boiler_efficiency
-    ).fillna(0)
-
-    buildings_with_benchmarks["building_energy_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_building_energy_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
+    demands = buildings_with_benchmarks[[e["intensity"] for e in end_uses]].to_numpy(
+        dtype="float64", copy=True
     )
-    buildings_with_benchmarks["process_energy_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_process_energy_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
+    demands[np.isnan(demands)] = 0
+    demands *= (
+        buildings_with_benchmarks["bounded_area_m2"]
+        .fillna(0)
+        .to_numpy(dtype="float64")[:, None]
     )
+    demands *= kwh_to_mwh
+    demands *= np.array([e["factor"] for e in end_uses], dtype="float64")
+    return demands
 
-    buildings_with_benchmarks["electricity_heat_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_electricity_heat_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
-        * boiler_efficiency
-    ).fillna(0)
-    buildings_with_benchmarks["fossil_fuel_heat_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks["typical_fossil_fuel_heat_kwh_per_m2y"].fillna(0)
-        * kwh_to_mwh
-        * boiler_efficiency
-    ).fillna(0)
-    buildings_with_benchmarks["industrial_low_temperature_heat_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks[
-            "typical_industrial_low_temperature_heat_kwh_per_m2y"
-        ].fillna(0)
-        * kwh_to_mwh
-    )
-    buildings_with_benchmarks["industrial_high_temperature_heat_demand_mwh_per_y"] = (
-        bounded_area_m2.fillna(0)
-        * buildings_with_benchmarks[
-            "typical_industrial_high_temperature_heat_kwh_per_m2y"
-        ].fillna(0)
-        * kwh_to_mwh
-    )
 
+def apply_energy_benchmarks_to_floor_areas(
+    upstream: Any, product: Any, end_uses: List[Dict[str, Any]]
+) -> None:
+    buildings_with_benchmarks = pd.read_parquet(
+        upstream["link_floor_areas_to_benchmarks"]
+    )
+    buildings_with_benchmarks[
+        [e["column"] for e in end_uses]
+    ] = _estimate_end_use_demands(buildings_with_benchmarks, end_uses=end_uses)
     buildings_with_benchmarks.to_csv(product, index=False)
 
 
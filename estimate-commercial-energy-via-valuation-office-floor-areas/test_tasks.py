@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from tasks import concatenate_local_authority_floor_areas
+
+LOCAL_AUTHORITIES = ["dcc", "dlrcc", "sdcc", "fcc"]
+
+
+def _write_workbooks(dirpath, workbooks):
+    upstream = {}
+    for local_authority, workbook in zip(LOCAL_AUTHORITIES, workbooks):
+        filepath = dirpath / f"valuation_office_floor_areas_{local_authority}.ods"
+        workbook.to_excel(filepath, index=False, engine="odf")
+        upstream[f"download_valuation_office_floor_areas_{local_authority}"] = str(
+            filepath
+        )
+    return upstream
+
+
+def test_concatenate_local_authority_floor_areas_with_mixed_dtypes(tmp_path):
+    # Use2 is empty in dcc (so read as float64) & text elsewhere, Uses is a number
+    # in dlrcc & text elsewhere
+    workbooks = [
+        pd.DataFrame(
+            {"PropertyNo": [1, 2], "Uses": ["OFFICE", "SHOP"], "Use2": [np.nan] * 2}
+        ),
+        pd.DataFrame({"PropertyNo": [3, 4], "Uses": [5, 6], "Use2": ["STORE", None]}),
+        pd.DataFrame({"PropertyNo": [5], "Uses": ["PUB"], "Use2": ["OFFICE"]}),
+        pd.DataFrame({"PropertyNo": [6], "Uses": ["HOTEL"], "Use2": [np.nan]}),
+    ]
+    upstream = _write_workbooks(tmp_path, workbooks)
+    product = tmp_path / "dublin.parquet"
+
+    concatenate_local_authority_floor_areas(
+        upstream=upstream,
+        product=product,
+        cache_dirpath=tmp_path / "cache",
+        n_workers=2,
+    )
+
+    dublin = pd.read_parquet(product)
+    assert dublin["PropertyNo"].tolist() == [1, 2, 3, 4, 5, 6]
+    assert dublin["Uses"].tolist() == ["OFFICE", "SHOP", "5", "6", "PUB", "HOTEL"]
+    assert dublin["Use2"].tolist() == [None, None, "STORE", None, "OFFICE", None]
+
+
+def test_concatenate_local_authority_floor_areas_reuses_cache(tmp_path):
+    workbooks = [
+        pd.DataFrame({"PropertyNo": [i], "Uses": ["OFFICE"]}) for i in range(4)
+    ]
+    upstream = _write_workbooks(tmp_path, workbooks)
+    product = tmp_path / "dublin.parquet"
+    kwargs = dict(upstream=upstream, product=product, cache_dirpath=tmp_path / "cache")
+
+    concatenate_local_authority_floor_areas(n_workers=1, **kwargs)
+    cache_filepaths = sorted((tmp_path / "cache").iterdir())
+    modification_times = [f.stat().st_mtime_ns for f in cache_filepaths]
+    concatenate_local_authority_floor_areas(n_workers=1, **kwargs)
+
+    assert sorted((tmp_path / "cache").iterdir()) == cache_filepaths
+    assert [f.stat().st_mtime_ns for f in cache_filepaths] == modification_times
+    assert pd.read_parquet(product)["PropertyNo"].tolist() == [0, 1, 2, 3]
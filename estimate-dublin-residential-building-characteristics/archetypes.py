@@ -0,0 +1,428 @@
+from functools import reduce
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from codema_dev_shared.modes import decode_modal_codes
+from codema_dev_shared.modes import get_grouped_modal_codes
+from codema_dev_shared.modes import get_value_codes
+import numpy as np
+import pandas as pd
+
+from bootstrap import bootstrap_archetype_values
+
+# Archetypes are medians & modes of buildings grouped at several levels, each of
+# which is a coarsening of the finest grouping of all archetype columns (an
+# "atom").  Value counts per atom are computed once for every column so that each
+# level is derived from these counts rather than from another pass over all rows
+
+# levels from most to least specific
+ARCHETYPE_COLUMNS = [
+    ["small_area", "period_built"],
+    ["cso_ed_id", "period_built"],
+    ["countyname", "period_built"],
+    ["period_built"],
+]
+
+
+def _sketch(numbers: np.ndarray, relative_error: float) -> np.ndarray:
+    # as in DDSketch each number is replaced by the centre of its logarithmic bucket
+    # (gamma^(k-1), gamma^k] which is within relative_error of every number in it, so
+    # any quantile of the sketched numbers is within relative_error of the true one &
+    # a column has a bounded number of distinct values however many rows it has
+    gamma = (1 + relative_error) / (1 - relative_error)
+    is_nonzero = np.abs(numbers) > 0
+    buckets = np.ceil(np.log(np.abs(numbers[is_nonzero])) / np.log(gamma))
+    sketched = numbers.copy()
+    sketched[is_nonzero] = (
+        np.sign(numbers[is_nonzero]) * 2 * np.power(gamma, buckets) / (gamma + 1)
+    )
+    return sketched
+
+
+def _get_value_codes(
+    values: pd.Series, is_numeric: bool, relative_error: Optional[float] = None
+) -> Tuple[np.ndarray, Any]:
+    # codes are ordered as pd.Series.mode orders its output so that ties resolve to
+    # the same value, -1 flags a missing value
+    if is_numeric:
+        numbers = values.to_numpy(dtype="float64", na_value=np.nan)
+        # integers have few enough distinct values to always count exactly
+        if relative_error is not None and pd.api.types.is_float_dtype(values.dtype):
+            numbers = _sketch(numbers, relative_error=relative_error)
+        is_missing = np.isnan(numbers)
+        uniques, codes = np.unique(numbers[~is_missing], return_inverse=True)
+        value_codes = np.full(len(values), -1, dtype="int64")
+        value_codes[~is_missing] = codes
+        return value_codes, uniques
+    else:
+        return get_value_codes(values)
+
+
+def _encode_atoms(
+    buildings: pd.DataFrame, key_columns: List[str]
+) -> Tuple[np.ndarray, np.ndarray, List[Any]]:
+    # shift codes by one so that missing keys form groups of their own
+    key_codes, key_uniques = zip(
+        *[pd.factorize(buildings[c], sort=True) for c in key_columns]
+    )
+    shifted_key_codes = [codes.astype("int64") + 1 for codes in key_codes]
+    dims = [len(uniques) + 1 for uniques in key_uniques]
+    raw_atoms = np.ravel_multi_index(shifted_key_codes, dims=dims)
+    unique_raw_atoms, atom_of_row = np.unique(raw_atoms, return_inverse=True)
+    atom_key_codes = np.stack(np.unravel_index(unique_raw_atoms, shape=dims), axis=1)
+    return atom_of_row, atom_key_codes - 1, list(key_uniques)
+
+
+def _get_value_counts(
+    value_codes: np.ndarray, atom_of_row: np.ndarray, n_values: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    is_known = value_codes != -1
+    pairs, counts = np.unique(
+        atom_of_row[is_known] * n_values + value_codes[is_known], return_counts=True
+    )
+    return pairs // n_values, pairs % n_values, counts
+
+
+def _get_level_groups(
+    atom_key_codes: np.ndarray, level_key_indices: List[int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    level_key_codes = atom_key_codes[:, level_key_indices]
+    is_missing = (level_key_codes == -1).any(axis=1)
+    unique_key_codes, groups = np.unique(
+        level_key_codes[~is_missing], axis=0, return_inverse=True
+    )
+    group_of_atom = np.full(len(atom_key_codes), -1, dtype="int64")
+    group_of_atom[~is_missing] = groups.ravel()
+    return group_of_atom, unique_key_codes
+
+
+def _rollup_value_counts(
+    atoms: np.ndarray,
+    codes: np.ndarray,
+    counts: np.ndarray,
+    group_of_atom: np.ndarray,
+    n_values: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    groups = group_of_atom[atoms]
+    is_grouped = groups != -1
+    pairs, inverse = np.unique(
+        groups[is_grouped] * n_values + codes[is_grouped], return_inverse=True
+    )
+    group_counts = np.bincount(inverse, weights=counts[is_grouped]).astype("int64")
+    return pairs // n_values, pairs % n_values, group_counts
+
+
+def _get_medians(
+    groups: np.ndarray,
+    codes: np.ndarray,
+    counts: np.ndarray,
+    uniques: np.ndarray,
+    n_groups: int,
+) -> np.ndarray:
+    # pairs are sorted by (group, code) and so by value within each group
+    if len(codes) == 0:
+        return np.full(n_groups, np.nan)
+    group_sizes = np.bincount(groups, weights=counts, minlength=n_groups).astype(
+        "int64"
+    )
+    cumulative_counts = np.cumsum(counts)
+    group_offsets = np.cumsum(group_sizes) - group_sizes
+    lower = np.searchsorted(
+        cumulative_counts, group_offsets + (group_sizes - 1) // 2, side="right"
+    )
+    upper = np.searchsorted(
+        cumulative_counts, group_offsets + group_sizes // 2, side="right"
+    )
+    is_empty = group_sizes == 0
+    lower[is_empty] = 0
+    upper[is_empty] = 0
+    medians = (uniques[codes[lower]] + uniques[codes[upper]]) / 2
+    medians[is_empty] = np.nan
+    return medians
+
+
+def count_archetype_values(
+    buildings: pd.DataFrame,
+    archetype_columns: List[List[str]],
+    relative_error: Optional[float] = None,
+) -> Iterator[Tuple[List[str], Dict[str, Any]]]:
+    key_columns = list(dict.fromkeys(c for a in archetype_columns for c in a))
+    atom_of_row, atom_key_codes, key_uniques = _encode_atoms(buildings, key_columns)
+    n_atoms = len(atom_key_codes)
+    atom_sizes = np.bincount(atom_of_row, minlength=n_atoms)
+
+    numeric_columns = buildings.select_dtypes("number").columns.tolist()
+    categorical_columns = buildings.select_dtypes(
+        ["object", "string", "category"]
+    ).columns.tolist()
+    statistics: Dict[str, Dict[str, Any]] = {}
+    for column in numeric_columns + categorical_columns:
+        is_numeric = column in numeric_columns
+        value_codes, uniques = _get_value_codes(
+            buildings[column], is_numeric=is_numeric, relative_error=relative_error
+        )
+        atoms, codes, counts = _get_value_counts(
+            value_codes, atom_of_row=atom_of_row, n_values=max(len(uniques), 1)
+        )
+        statistics[column] = {
+            "is_numeric": is_numeric,
+            "uniques": uniques,
+            "atoms": atoms,
+            "codes": codes,
+            "counts": counts,
+            "dtype": buildings[column].dtype,
+        }
+
+    for archetype in archetype_columns:
+        level_key_indices = [key_columns.index(c) for c in archetype]
+        group_of_atom, group_key_codes = _get_level_groups(
+            atom_key_codes, level_key_indices=level_key_indices
+        )
+        n_groups = len(group_key_codes)
+
+        keys = pd.DataFrame(
+            {
+                c: key_uniques[i].take(group_key_codes[:, j])
+                for j, (c, i) in enumerate(zip(archetype, level_key_indices))
+            }
+        )
+        columns = {}
+        for column, s in statistics.items():
+            if column in archetype:
+                continue
+            groups, codes, counts = _rollup_value_counts(
+                s["atoms"],
+                codes=s["codes"],
+                counts=s["counts"],
+                group_of_atom=group_of_atom,
+                n_values=max(len(s["uniques"]), 1),
+            )
+            columns[column] = {
+                "is_numeric": s["is_numeric"],
+                "uniques": s["uniques"],
+                "groups": groups,
+                "codes": codes,
+                "counts": counts,
+                "dtype": s["dtype"],
+            }
+
+        is_grouped = group_of_atom != -1
+        sample_size = np.bincount(
+            group_of_atom[is_grouped],
+            weights=atom_sizes[is_grouped],
+            minlength=n_groups,
+        ).astype("int64")
+
+        yield archetype, {"keys": keys, "columns": columns, "sample_size": sample_size}
+
+
+def _union_uniques(uniques: List[Any], is_categorical: bool) -> pd.Index:
+    # categories keep the order in which they first appear, as arrow unifies the
+    # dictionaries of a table's chunks, so that chunks break modal ties as the whole
+    # table would, other values are sorted as pd.factorize sorts them
+    indexes = [pd.Index(u) for u in uniques]
+    if is_categorical:
+        return reduce(lambda a, b: a.append(b.difference(a, sort=False)), indexes)
+    else:
+        return reduce(pd.Index.union, indexes)
+
+
+def merge_archetype_values(value_counts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # value counts of the same level from disjoint sets of buildings (i.e. shards)
+    # sum to the value counts of all buildings, so medians & modes stay exact
+    if len(value_counts) == 1:
+        return value_counts[0]
+    shard_keys = pd.concat([v["keys"] for v in value_counts], ignore_index=True)
+    group_of_row, unique_keys = pd.factorize(
+        pd.MultiIndex.from_frame(shard_keys), sort=True
+    )
+    keys = unique_keys.set_names(shard_keys.columns).to_frame(index=False)
+    n_groups = len(keys)
+    offsets = np.cumsum([0] + [len(v["keys"]) for v in value_counts[:-1]])
+
+    columns = {}
+    for column, first in value_counts[0]["columns"].items():
+        shard_columns = [v["columns"][column] for v in value_counts]
+        if first["is_numeric"]:
+            uniques = reduce(np.union1d, [c["uniques"] for c in shard_columns])
+            remaps = [np.searchsorted(uniques, c["uniques"]) for c in shard_columns]
+        else:
+            uniques = _union_uniques(
+                [c["uniques"] for c in shard_columns],
+                is_categorical=isinstance(first["dtype"], pd.CategoricalDtype),
+            )
+            remaps = [uniques.get_indexer(c["uniques"]) for c in shard_columns]
+        groups, codes, counts = _rollup_value_counts(
+            np.concatenate([o + c["groups"] for o, c in zip(offsets, shard_columns)]),
+            codes=np.concatenate(
+                [r[c["codes"]] for r, c in zip(remaps, shard_columns)]
+            ).astype("int64"),
+            counts=np.concatenate([c["counts"] for c in shard_columns]),
+            group_of_atom=group_of_row.astype("int64"),
+            n_values=max(len(uniques), 1),
+        )
+        columns[column] = {
+            **first,
+            "uniques": uniques,
+            "groups": groups,
+            "codes": codes,
+            "counts": counts,
+        }
+
+    sample_size = np.bincount(
+        group_of_row,
+        weights=np.concatenate([v["sample_size"] for v in value_counts]),
+        minlength=n_groups,
+    ).astype("int64")
+
+    return {"keys": keys, "columns": columns, "sample_size": sample_size}
+
+
+def aggregate_archetype_values(
+    value_counts: Dict[str, Any], bootstrap: Optional[Dict[str, Any]] = None
+) -> pd.DataFrame:
+    n_groups = len(value_counts["keys"])
+    aggregated = {c: value_counts["keys"][c] for c in value_counts["keys"].columns}
+    for column, c in value_counts["columns"].items():
+        if c["is_numeric"]:
+            medians = _get_medians(
+                c["groups"],
+                codes=c["codes"],
+                counts=c["counts"],
+                uniques=c["uniques"],
+                n_groups=n_groups,
+            )
+            if pd.api.types.is_float_dtype(c["dtype"]):
+                medians = medians.astype(c["dtype"])
+            aggregated[column] = medians
+        else:
+            modal_codes = get_grouped_modal_codes(
+                c["groups"],
+                codes=c["codes"],
+                n_groups=n_groups,
+                n_codes=len(c["uniques"]),
+                weights=c["counts"],
+            )
+            aggregated[column] = decode_modal_codes(modal_codes, c["uniques"])
+    if bootstrap is not None:
+        aggregated.update(bootstrap_archetype_values(value_counts, **bootstrap))
+    aggregated["sample_size"] = value_counts["sample_size"]
+    return pd.DataFrame(aggregated)
+
+
+def rollup_archetypes(
+    buildings: pd.DataFrame,
+    archetype_columns: List[List[str]],
+    relative_error: Optional[float] = None,
+    bootstrap: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[List[str], pd.DataFrame]]:
+    for archetype, value_counts in count_archetype_values(
+        buildings, archetype_columns, relative_error=relative_error
+    ):
+        yield archetype, aggregate_archetype_values(value_counts, bootstrap=bootstrap)
+
+
+def sort_categories(buildings: pd.DataFrame) -> pd.DataFrame:
+    # modal ties resolve to the first category, so categories are sorted to break
+    # ties the same way whichever partitions or county shards buildings come from
+    return buildings.apply(
+        lambda s: s.cat.reorder_categories(sorted(s.cat.categories))
+        if isinstance(s.dtype, pd.CategoricalDtype)
+        else s
+    )
+
+
+def stream_archetypes(
+    chunks: Iterable[pd.DataFrame],
+    archetype_columns: List[List[str]],
+    relative_error: Optional[float] = None,
+    bootstrap: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[List[str], pd.DataFrame]]:
+    # value counts of each chunk are merged into those of all previous chunks so
+    # only one chunk of buildings is ever in memory, sketching numbers bounds the
+    # size of the counts & merging keeps the order of categories so only numbers
+    # differ from rollup_archetypes
+    merged: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for chunk in chunks:
+        for archetype, value_counts in count_archetype_values(
+            chunk, archetype_columns, relative_error=relative_error
+        ):
+            key = tuple(archetype)
+            if key in merged:
+                value_counts = merge_archetype_values([merged[key], value_counts])
+            merged[key] = value_counts
+
+    for archetype in archetype_columns:
+        yield archetype, aggregate_archetype_values(
+            merged[tuple(archetype)], bootstrap=bootstrap
+        )
+
+
+def _encode_keys(
+    frame: pd.DataFrame, columns: List[str], categories: List[pd.Index]
+) -> np.ndarray:
+    # keys are compared as strings as archetypes are read back from csv
+    column_codes = [
+        pd.Categorical(frame[c].astype(str), categories=category).codes.astype("int64")
+        for c, category in zip(columns, categories)
+    ]
+    is_missing = np.logical_or.reduce([codes == -1 for codes in column_codes])
+    keys = np.ravel_multi_index(
+        [np.where(is_missing, 0, codes) for codes in column_codes],
+        dims=[len(category) for category in categories],
+    ).astype("int64")
+    keys[is_missing] = -1
+    return keys
+
+
+def build_archetype_index(
+    archetypes: List[Tuple[List[str], pd.DataFrame]]
+) -> Dict[str, Any]:
+    levels = []
+    offset = 0
+    for columns, table in archetypes:
+        # a level without any archetypes of sufficient size can never be found
+        if len(table) == 0:
+            continue
+        categories = [pd.Index(table[c].astype(str).unique()) for c in columns]
+        keys = _encode_keys(table, columns=columns, categories=categories)
+        levels.append(
+            {
+                "columns": columns,
+                "categories": categories,
+                "keys": pd.Index(keys),
+                "offset": offset,
+            }
+        )
+        offset += len(table)
+
+    # empty levels are left out as these would upcast dtypes, unless all are empty
+    # in which case these still give the archetypes their columns
+    tables = [t for _, t in archetypes if len(t) > 0] or [t for _, t in archetypes]
+    if len(tables) == 0:
+        tables = [pd.DataFrame()]
+    return {"levels": levels, "archetypes": pd.concat(tables, ignore_index=True)}
+
+
+def find_archetypes(index: Dict[str, Any], buildings: pd.DataFrame) -> np.ndarray:
+    # each building takes the archetype of its most specific level, levels are
+    # ordered from most to least specific
+    positions = np.full(len(buildings), -1, dtype="int64")
+    for level in index["levels"]:
+        unresolved = np.flatnonzero(positions == -1)
+        if len(unresolved) == 0:
+            break
+        keys = _encode_keys(
+            buildings.iloc[unresolved],
+            columns=level["columns"],
+            categories=level["categories"],
+        )
+        found = level["keys"].get_indexer(keys)
+        is_found = (keys != -1) & (found != -1)
+        positions[unresolved[is_found]] = found[is_found] + level["offset"]
+    return positions
@@ -0,0 +1,174 @@
+"""Time the heavy tasks of pipeline.yaml on synthetic BERs & census buildings.
+
+    python benchmark.py --rows 100000 1000000 5000000
+
+Each task runs in a fresh process within data/benchmarks/<rows> so that its peak
+resident memory is its own, results are appended to data/benchmarks/results.csv
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from shutil import rmtree
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+
+import pandas as pd
+import yaml
+
+from synthetic import write_synthetic_inputs
+
+SYNTHETIC_TASKS = [
+    "download_building_energy_ratings",
+    "download_census_building_ages",
+    "download_dublin_small_area_ids",
+    "download_small_area_electoral_district_id_map",
+]
+
+# extract_dublin_census_buildings & create_small_area_keys are cheap but
+# fill_census_with_bers needs them
+BENCHMARKED_TASKS = [
+    "save_selected_columns_as_parquet",
+    "extract_buildings_meeting_conditions",
+    "extract_dublin_census_buildings",
+    "create_small_area_keys",
+    "fill_census_with_bers",
+    "create_archetypes",
+    "fill_unknown_buildings_with_archetypes",
+]
+
+
+def _get_task_name(task: Dict[str, Any]) -> str:
+    return task.get("name", task["source"].split(".")[-1])
+
+
+def _read_tasks(filepath: Path) -> Dict[str, Dict[str, Any]]:
+    with open(filepath, "r") as f:
+        tasks = yaml.safe_load(f)
+    return {_get_task_name(task): task for task in tasks}
+
+
+def _get_peak_rss_mb() -> float:
+    # unlike ru_maxrss the high water mark isn't inherited from the parent process
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise OSError("Peak RSS is only reported on linux")
+
+
+def _run_task(
+    dirpath: Path, task: Dict[str, Any], products: Dict[str, Any], queue: Any
+) -> None:
+    import tasks
+
+    os.chdir(dirpath)
+
+    product = products[_get_task_name(task)]
+    for filepath in [product] if isinstance(product, str) else product.values():
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    function = getattr(tasks, task["source"].split(".")[-1])
+
+    baseline_rss_mb = _get_peak_rss_mb()
+    start = time.perf_counter()
+    function(product=product, upstream=products, **task.get("params", {}))
+    queue.put(
+        {
+            "seconds": time.perf_counter() - start,
+            "baseline_rss_mb": baseline_rss_mb,
+            "peak_rss_mb": _get_peak_rss_mb(),
+        }
+    )
+
+
+def benchmark(
+    n_rows: int, seed: int, dirpath: Path, spec_filepath: Path
+) -> List[Dict[str, Any]]:
+    tasks = _read_tasks(spec_filepath)
+    products = {name: task["product"] for name, task in tasks.items()}
+
+    download_filepaths = {name: dirpath / products[name] for name in SYNTHETIC_TASKS}
+    ber_columns = list(tasks["save_selected_columns_as_parquet"]["params"]["names"])
+
+    # generating millions of rows takes minutes so inputs are reused if possible
+    inputs = {"rows": n_rows, "seed": seed, "ber_columns": ber_columns}
+    inputs_filepath = dirpath / "inputs.json"
+    if inputs_filepath.exists():
+        with open(inputs_filepath, "r") as f:
+            is_generated = json.load(f) == inputs
+    else:
+        is_generated = False
+
+    if is_generated:
+        input_filepaths = {p.resolve() for p in download_filepaths.values()}
+        for filepath in dirpath.glob("data/*/*"):
+            if filepath.resolve() in input_filepaths:
+                continue
+            elif filepath.is_dir():
+                rmtree(filepath)
+            else:
+                filepath.unlink()
+    else:
+        if dirpath.exists():
+            rmtree(dirpath)
+        for filepath in download_filepaths.values():
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        write_synthetic_inputs(
+            download_filepaths, n_rows=n_rows, seed=seed, ber_columns=ber_columns
+        )
+        with open(inputs_filepath, "w") as f:
+            json.dump(inputs, f)
+        print(f"Generated {n_rows} rows in {time.perf_counter() - start:.1f}s")
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in BENCHMARKED_TASKS:
+        queue = context.Queue()
+        process = context.Process(
+            target=_run_task, args=(dirpath.resolve(), tasks[name], products, queue)
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"{name} failed on {n_rows} rows")
+        result = {"rows": n_rows, "seed": seed, "task": name, **queue.get()}
+        print(
+            f"{name}: {result['seconds']:.2f}s, peak RSS {result['peak_rss_mb']:.0f}MB"
+        )
+        results.append(result)
+
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dirpath", type=Path, default=Path("data/benchmarks"))
+    parser.add_argument("--spec", type=Path, default=Path("pipeline.yaml"))
+    args = parser.parse_args()
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    for n_rows in args.rows:
+        results = benchmark(
+            n_rows,
+            seed=args.seed,
+            dirpath=args.dirpath / str(n_rows),
+            spec_filepath=args.spec,
+        )
+        results_filepath = args.dirpath / "results.csv"
+        pd.DataFrame(results).assign(timestamp=timestamp).to_csv(
+            results_filepath,
+            mode="a",
+            header=not results_filepath.exists(),
+            index=False,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from codema_dev_shared.modes import get_grouped_modal_codes
+import numpy as np
+import pandas as pd
+
+# Archetypes are bootstrapped from their value counts rather than by resampling
+# buildings.  Within a group of n buildings a column's known values are laid out in
+# order of value followed by its missing values, so a resample is n positions drawn
+# with replacement & sorted, its known values are then its positions below the
+# number of known values & its median & modal counts are a few lookups.
+# Resamples are drawn as one integer matrix for blocks of groups of the same size
+
+# a drawn position, its key & count of positions below it, & the codes, groups &
+# keys of a column with many categories, are all int64
+BYTES_PER_DRAW = 56
+
+# categories of columns with up to this many are counted by binary searches,
+# those of others are decoded at every drawn position
+MAX_SEARCHED_CODES = 64
+
+
+def _iter_resample_blocks(
+    sample_size: np.ndarray, n_resamples: int, memory_budget: int, min_sample_size: int
+) -> Iterator[Tuple[np.ndarray, int, int]]:
+    # yields (groups, start, stop) where stop - start resamples of each group fit in
+    # the budget, a group too big to resample at once is resampled in several blocks.
+    # A resample of a small group still searches the bounds of every category
+    # groups too small to be archetypes aren't resampled
+    for size in np.unique(sample_size[sample_size > min_sample_size]):
+        groups = np.flatnonzero(sample_size == size)
+        bytes_per_resample = BYTES_PER_DRAW * max(size, MAX_SEARCHED_CODES + 1)
+        groups_per_block = memory_budget // (bytes_per_resample * n_resamples)
+        if groups_per_block > 0:
+            for start in range(0, len(groups), groups_per_block):
+                yield groups[start : start + groups_per_block], 0, n_resamples
+        else:
+            resamples_per_block = max(memory_budget // bytes_per_resample, 1)
+            for group in groups:
+                for start in range(0, n_resamples, resamples_per_block):
+                    stop = min(start + resamples_per_block, n_resamples)
+                    yield group[None], start, stop
+
+
+def _count_positions_below(positions: np.ndarray) -> np.ndarray:
+    # element [i, t] is the number of positions of resample i below t
+    n_rows, sample_size = positions.shape
+    keys = np.arange(n_rows)[:, None] * (sample_size + 1) + positions + 1
+    counts = np.bincount(keys.ravel(), minlength=n_rows * (sample_size + 1))
+    return counts.reshape(n_rows, sample_size + 1).cumsum(axis=1)
+
+
+def _count_below(below: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    rows = np.arange(len(below)).reshape((-1,) + (1,) * (thresholds.ndim - 1))
+    return below[rows, thresholds]
+
+
+def _get_row_quantiles(values: np.ndarray, quantiles: np.ndarray) -> np.ndarray:
+    # linearly interpolated as np.nanquantile but without warning about rows which
+    # have no values
+    values = np.sort(values, axis=1)
+    n_known = np.count_nonzero(~np.isnan(values), axis=1)
+    rows = np.arange(len(values))[:, None]
+    positions = quantiles[None, :] * np.maximum(n_known - 1, 0)[:, None]
+    lower = np.floor(positions).astype("int64")
+    upper = np.ceil(positions).astype("int64")
+    row_quantiles = values[rows, lower] + (
+        values[rows, upper] - values[rows, lower]
+    ) * (positions - lower)
+    row_quantiles[n_known == 0] = np.nan
+    return row_quantiles
+
+
+def _get_pairs(
+    positions: np.ndarray, group_offsets: np.ndarray, cumulative_counts: np.ndarray
+) -> np.ndarray:
+    # a known position of a group is mapped to its (group, code) pair, positions of
+    # missing values are mapped to whichever pair follows so must be masked
+    pairs = np.searchsorted(cumulative_counts, group_offsets + positions, side="right")
+    return np.minimum(pairs, len(cumulative_counts) - 1)
+
+
+def _get_resampled_medians(
+    positions: np.ndarray,
+    n_known: np.ndarray,
+    group_offsets: np.ndarray,
+    cumulative_counts: np.ndarray,
+    values: np.ndarray,
+) -> np.ndarray:
+    # known positions come first in each sorted resample so its middle known
+    # positions are found by index
+    if len(cumulative_counts) == 0:
+        return np.full(len(positions), np.nan)
+    rows = np.arange(len(positions))
+    last = positions.shape[1] - 1
+    lower = positions[rows, np.minimum(np.maximum(n_known - 1, 0) // 2, last)]
+    upper = positions[rows, np.minimum(n_known // 2, last)]
+    lower_values = values[_get_pairs(lower, group_offsets, cumulative_counts)]
+    upper_values = values[_get_pairs(upper, group_offsets, cumulative_counts)]
+    return np.where(n_known == 0, np.nan, (lower_values + upper_values) / 2)
+
+
+def _get_resampled_modal_codes(
+    positions: np.ndarray,
+    n_known: np.ndarray,
+    group_offsets: np.ndarray,
+    cumulative_counts: np.ndarray,
+    codes: np.ndarray,
+    n_codes: int,
+) -> np.ndarray:
+    n_rows, sample_size = positions.shape
+    if len(cumulative_counts) == 0:
+        return np.full(n_rows, -1, dtype="int64")
+    resampled_codes = codes[
+        _get_pairs(positions, group_offsets[:, None], cumulative_counts)
+    ]
+    resampled_codes[positions >= n_known[:, None]] = -1
+    return get_grouped_modal_codes(
+        np.repeat(np.arange(n_rows), sample_size),
+        codes=resampled_codes.ravel(),
+        n_groups=n_rows,
+        n_codes=n_codes,
+    )
+
+
+def bootstrap_archetype_values(
+    value_counts: Dict[str, Any],
+    n_resamples: int,
+    confidence_level: float,
+    memory_budget: int,
+    random_state: Optional[int] = None,
+    min_sample_size: int = 0,
+) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(random_state)
+    n_groups = len(value_counts["keys"])
+    sample_size = value_counts["sample_size"]
+    alpha = (1 - confidence_level) / 2
+    quantiles = np.array([alpha, 0.5, 1 - alpha])
+
+    statistics = {}
+    for column, c in value_counts["columns"].items():
+        known_sizes = np.bincount(
+            c["groups"], weights=c["counts"], minlength=n_groups
+        ).astype("int64")
+        s = {
+            "n_known": known_sizes,
+            "cumulative_counts": np.cumsum(c["counts"]),
+            "group_offsets": np.cumsum(known_sizes) - known_sizes,
+        }
+        if c["is_numeric"]:
+            s["values"] = c["uniques"][c["codes"]]
+            s["intervals"] = np.full((n_groups, len(quantiles)), np.nan)
+        else:
+            n_codes = len(c["uniques"])
+            if n_codes <= MAX_SEARCHED_CODES:
+                # a group's known positions of each code lie between these bounds
+                counts = np.bincount(
+                    c["groups"] * n_codes + c["codes"],
+                    weights=c["counts"],
+                    minlength=n_groups * n_codes,
+                ).reshape(n_groups, n_codes)
+                s["bounds"] = np.hstack(
+                    [np.zeros((n_groups, 1)), np.cumsum(counts, axis=1)]
+                ).astype("int64")
+            s["codes"] = c["codes"]
+            s["n_codes"] = n_codes
+            s["modal_codes"] = get_grouped_modal_codes(
+                c["groups"],
+                codes=c["codes"],
+                n_groups=n_groups,
+                n_codes=n_codes,
+                weights=c["counts"],
+            )
+            s["n_agreeing"] = np.zeros(n_groups, dtype="int64")
+        statistics[column] = s
+
+    resampled_medians: Dict[str, list] = {c: [] for c in statistics}
+    for groups, start, stop in _iter_resample_blocks(
+        sample_size,
+        n_resamples=n_resamples,
+        memory_budget=memory_budget,
+        min_sample_size=min_sample_size,
+    ):
+        size = sample_size[groups[0]]
+        row_groups = np.repeat(groups, stop - start)
+        positions = rng.integers(0, size, size=(len(row_groups), size))
+        positions.sort(axis=1)
+        below = _count_positions_below(positions)
+
+        for column, s in statistics.items():
+            n_known = _count_below(below, thresholds=s["n_known"][row_groups])
+            if "values" in s:
+                resampled_medians[column].append(
+                    _get_resampled_medians(
+                        positions,
+                        n_known=n_known,
+                        group_offsets=s["group_offsets"][row_groups],
+                        cumulative_counts=s["cumulative_counts"],
+                        values=s["values"],
+                    ).reshape(len(groups), stop - start)
+                )
+            else:
+                if "bounds" in s and s["n_codes"] > 0:
+                    resampled_counts = np.diff(
+                        _count_below(below, thresholds=s["bounds"][row_groups]), axis=1
+                    )
+                    resampled_modal_codes = resampled_counts.argmax(axis=1)
+                    resampled_modal_codes[resampled_counts.max(axis=1) == 0] = -1
+                else:
+                    resampled_modal_codes = _get_resampled_modal_codes(
+                        positions,
+                        n_known=s["n_known"][row_groups],
+                        group_offsets=s["group_offsets"][row_groups],
+                        cumulative_counts=s["cumulative_counts"],
+                        codes=s["codes"],
+                        n_codes=s["n_codes"],
+                    )
+                s["n_agreeing"] += np.bincount(
+                    row_groups,
+                    weights=resampled_modal_codes == s["modal_codes"][row_groups],
+                    minlength=n_groups,
+                ).astype("int64")
+
+        # a group's intervals are computed once all of its resamples are drawn
+        if stop == n_resamples:
+            for column, s in statistics.items():
+                if "values" in s:
+                    medians = np.hstack(resampled_medians[column])
+                    s["intervals"][groups] = _get_row_quantiles(medians, quantiles)
+                    resampled_medians[column] = []
+
+    bootstrapped = {}
+    for column, s in statistics.items():
+        c = value_counts["columns"][column]
+        if "values" in s:
+            intervals = s["intervals"]
+            if pd.api.types.is_float_dtype(c["dtype"]):
+                intervals = intervals.astype(c["dtype"])
+            for i, name in enumerate(["lower", "median", "upper"]):
+                bootstrapped[f"{column}__{name}"] = intervals[:, i]
+        else:
+            # the share of resamples whose mode is the archetype's mode
+            mode_share = s["n_agreeing"] / n_resamples
+            mode_share[
+                (s["modal_codes"] == -1) | (sample_size <= min_sample_size)
+            ] = np.nan
+            bootstrapped[f"{column}__mode_share"] = mode_share
+    return bootstrapped
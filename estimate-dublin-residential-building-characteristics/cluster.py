@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from distributed import Client
+from distributed import LocalCluster
+import numpy as np
+import pandas as pd
+
+# The heavy tasks can run their work in partitions on a local cluster of worker
+# processes, each partition is computed by the same function as on the pandas
+# backend & partitions are reassembled in their original order so that both
+# backends produce identical results
+
+BACKENDS = ["pandas", "dask"]
+
+# more partitions than workers so that a slow partition doesn't hold up the rest
+PARTITIONS_PER_WORKER = 4
+
+
+@contextmanager
+def start_client(
+    backend: str, n_workers: int, memory_limit: str
+) -> Iterator[Optional[Client]]:
+    if backend == "pandas":
+        yield None
+    elif backend == "dask":
+        # pandas holds the GIL for most of this work so each worker is a process
+        with LocalCluster(
+            n_workers=n_workers,
+            threads_per_worker=1,
+            processes=True,
+            memory_limit=memory_limit,
+        ) as cluster:
+            with Client(cluster) as client:
+                yield client
+    else:
+        raise ValueError(f"backend must be one of {BACKENDS}, not {backend}")
+
+
+def get_n_partitions(client: Client) -> int:
+    return PARTITIONS_PER_WORKER * len(client.scheduler_info()["workers"])
+
+
+def map_partitions(
+    client: Client, function: Callable, *partitions: Iterable[Any], **kwargs: Any
+) -> List[Any]:
+    # arguments shared by every partition are sent to each worker once
+    shared = {k: client.scatter([v], broadcast=True)[0] for k, v in kwargs.items()}
+    futures = client.map(function, *partitions, pure=False, **shared)
+    return client.gather(futures)
+
+
+def split_rows(df: pd.DataFrame, n_partitions: int) -> List[pd.DataFrame]:
+    # no partition is empty unless df is
+    n_partitions = max(min(n_partitions, len(df)), 1)
+    bounds = np.linspace(0, len(df), n_partitions + 1).astype("int64")
+    return [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def get_partition_ids(values: pd.Series, n_partitions: int) -> np.ndarray:
+    # rows with equal values are always in the same partition
+    hashes = pd.util.hash_array(values.astype(str).to_numpy(dtype="object"))
+    return (hashes % np.uint64(n_partitions)).astype("int64")
@@ -0,0 +1,62 @@
+from typing import Any
+from typing import Dict
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from dtypes import get_bytes_per_value
+from filters import get_condition_columns
+
+# Downstream projects each use a handful of the selected BER columns, so only the
+# columns which are published or filtered on are read from BERPublicsearch & the
+# latter are dropped as soon as buildings are filtered.  The published columns are
+# kept by hand in pipeline.yaml, they are not derived from what tasks read
+
+# columns which tasks use to filter, match or group buildings
+KEY_COLUMNS = ["small_area", "countyname", "year_of_construction"]
+
+
+def get_published_columns(columns: List[str]) -> List[str]:
+    return list(dict.fromkeys(KEY_COLUMNS + list(columns)))
+
+
+def get_required_columns(columns: List[str], conditions: List[Any]) -> List[str]:
+    return list(
+        dict.fromkeys(
+            get_published_columns(columns) + get_condition_columns(conditions)
+        )
+    )
+
+
+def report_column_usage(
+    names: Dict[str, str],
+    dtypes: Dict[str, str],
+    columns: List[str],
+    conditions: List[Any],
+    n_rows: int,
+) -> pd.DataFrame:
+    # bytes avoided are those which an unused column would take in memory & in
+    # every intermediate, ignoring its null mask
+    report = pd.DataFrame(
+        {
+            "name": list(names),
+            "column": list(names.values()),
+            "dtype": [dtypes[c] for c in names],
+        }
+    )
+    report["used_by"] = np.select(
+        [
+            report["column"].isin(get_published_columns(columns)),
+            report["column"].isin(get_condition_columns(conditions)),
+        ],
+        ["downstream", "conditions"],
+        default="nothing",
+    )
+    report["bytes_avoided"] = [
+        n_rows * get_bytes_per_value(dtype, has_missing=False)
+        if used_by == "nothing"
+        else 0
+        for dtype, used_by in zip(report["dtype"], report["used_by"])
+    ]
+    return report
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from zipfile import BadZipFile
+from zipfile import is_zipfile
+from zipfile import ZipFile
+
+import requests
+
+CHUNK_SIZE = 2**20
+
+
+def _read_metadata(filepath: Path) -> Dict[str, Any]:
+    if filepath.exists():
+        with open(filepath, "r") as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+def _write_metadata(filepath: Path, metadata: Dict[str, Any]) -> None:
+    with open(filepath, "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+def _get_validators(response: requests.Response) -> Dict[str, Optional[str]]:
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def _hash_file(filepath: Path) -> Any:
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256
+
+
+def _verify(filepath: Path, expected_size: Optional[int]) -> None:
+    size = filepath.stat().st_size
+    if expected_size is not None and size != expected_size:
+        raise IOError(
+            f"Downloaded {size} of {expected_size} bytes, rerun to resume the download"
+        )
+    if is_zipfile(filepath):
+        try:
+            with ZipFile(filepath) as zf:
+                corrupt_member = zf.testzip()
+        except BadZipFile as e:
+            corrupt_member = str(e)
+        if corrupt_member is not None:
+            filepath.unlink()
+            raise IOError(f"{filepath} is corrupt ({corrupt_member}), deleted download")
+
+
+def fetch_file(
+    url: str,
+    filepath: PathLike,
+    method: str = "GET",
+    sha256: Optional[str] = None,
+    **request_kwargs: Any,
+) -> bool:
+    """Download url to filepath, returns False if the content is unchanged.
+
+    A partial download is resumed via a Range request if the server supports it,
+    a complete download is revalidated with If-None-Match/If-Modified-Since, and
+    filepath is left untouched if the new content hashes the same as the old.
+    """
+    filepath = Path(filepath)
+    partial_filepath = filepath.with_name(filepath.name + ".partial")
+    metadata_filepath = filepath.with_name(filepath.name + ".download.json")
+    metadata = _read_metadata(metadata_filepath)
+
+    headers = dict(request_kwargs.pop("headers", {}))
+    partial_validators = metadata.get("partial", {})
+    resume_from = partial_filepath.stat().st_size if partial_filepath.exists() else 0
+    partial_validator = partial_validators.get("etag") or partial_validators.get(
+        "last_modified"
+    )
+    if resume_from and partial_validator:
+        headers["Range"] = f"bytes={resume_from}-"
+        headers["If-Range"] = partial_validator
+    elif filepath.exists():
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    with requests.request(
+        method, url, headers=headers, stream=True, **request_kwargs
+    ) as response:
+        # neither the file, its mtime nor its metadata are touched if unmodified
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            sha256_hash = _hash_file(partial_filepath)
+            mode = "ab"
+        else:
+            sha256_hash = hashlib.sha256()
+            resume_from = 0
+            mode = "wb"
+
+        validators = _get_validators(response)
+        _write_metadata(metadata_filepath, {**metadata, "partial": validators})
+
+        # the length of an encoded response is not the length of the file
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None and "Content-Encoding" not in response.headers:
+            expected_size = resume_from + int(content_length)
+        else:
+            expected_size = None
+        with open(partial_filepath, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                sha256_hash.update(chunk)
+
+    _verify(partial_filepath, expected_size=expected_size)
+    digest = sha256_hash.hexdigest()
+    if sha256 is not None and digest != sha256:
+        partial_filepath.unlink()
+        raise IOError(f"Expected sha256 {sha256} but downloaded {digest}")
+
+    is_changed = not (filepath.exists() and metadata.get("sha256") == digest)
+    if is_changed:
+        os.replace(partial_filepath, filepath)
+    else:
+        partial_filepath.unlink()
+    _write_metadata(
+        metadata_filepath,
+        {**validators, "sha256": digest, "size": filepath.stat().st_size},
+    )
+    return is_changed
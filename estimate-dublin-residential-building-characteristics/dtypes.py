@@ -0,0 +1,140 @@
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# BERPublicsearch declares every number a float but many are counts or whole
+# percentages, so value ranges are profiled on ingest & each column is narrowed to
+# the smallest type which holds all of its values exactly
+
+# narrowest first, nullable so that missing values stay missing
+INTEGER_DTYPES = ["UInt8", "Int8", "UInt16", "Int16", "UInt32", "Int32"]
+
+_ARROW_TO_PANDAS_DTYPES = {
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.int8(): pd.Int8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+
+def get_pandas_dtype(arrow_type: pa.DataType) -> Optional[Any]:
+    # arrow converts integers with missing values to float64 by default
+    return _ARROW_TO_PANDAS_DTYPES.get(arrow_type)
+
+
+def profile_numbers(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    profile = {}
+    for column in df.select_dtypes("number").columns:
+        values = df[column].to_numpy(dtype="float64", na_value=np.nan)
+        is_missing = np.isnan(values)
+        known_values = values[~is_missing]
+        profile[column] = {
+            "rows": len(values),
+            "missing": int(is_missing.sum()),
+            "min": float(known_values.min()) if len(known_values) else None,
+            "max": float(known_values.max()) if len(known_values) else None,
+            "is_integral": bool(np.all(known_values == np.round(known_values))),
+            "is_float32": bool(np.all(known_values.astype("float32") == known_values)),
+        }
+    return profile
+
+
+def merge_profiles(
+    profile: Dict[str, Dict[str, Any]], other: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    merged = dict(profile)
+    for column, b in other.items():
+        if column not in profile:
+            merged[column] = b
+            continue
+        a = profile[column]
+        merged[column] = {
+            "rows": a["rows"] + b["rows"],
+            "missing": a["missing"] + b["missing"],
+            "min": min(
+                (x for x in [a["min"], b["min"]] if x is not None), default=None
+            ),
+            "max": max(
+                (x for x in [a["max"], b["max"]] if x is not None), default=None
+            ),
+            "is_integral": a["is_integral"] and b["is_integral"],
+            "is_float32": a["is_float32"] and b["is_float32"],
+        }
+    return merged
+
+
+def _get_integer_dtype(low: float, high: float) -> Optional[str]:
+    for dtype in INTEGER_DTYPES:
+        limits = np.iinfo(dtype.lower())
+        if limits.min <= low and high <= limits.max:
+            return dtype
+    return None
+
+
+def get_bytes_per_value(dtype: str, has_missing: bool) -> int:
+    # nullable types store a byte mask alongside their values, categories are
+    # counted as their int32 codes
+    if dtype == "category":
+        return 4
+    pandas_dtype = pd.api.types.pandas_dtype(dtype)
+    if isinstance(pandas_dtype, pd.api.extensions.ExtensionDtype):
+        return pandas_dtype.numpy_dtype.itemsize + int(has_missing)
+    else:
+        return pandas_dtype.itemsize
+
+
+def plan_dtypes(
+    dtypes: Dict[str, str], profile: Dict[str, Dict[str, Any]]
+) -> Dict[str, str]:
+    # a column without any values keeps its declared type
+    planned_dtypes = {}
+    for column, dtype in dtypes.items():
+        p = profile.get(column)
+        if p is None or p["min"] is None:
+            planned_dtypes[column] = dtype
+            continue
+
+        has_missing = p["missing"] > 0
+        candidates = [dtype]
+        if p["is_integral"]:
+            candidates.append(_get_integer_dtype(p["min"], p["max"]))
+        if p["is_float32"]:
+            candidates.append("float32")
+        planned_dtypes[column] = min(
+            [c for c in candidates if c is not None],
+            key=lambda c: get_bytes_per_value(c, has_missing),
+        )
+    return planned_dtypes
+
+
+def get_memory_savings(
+    dtypes: Dict[str, str],
+    planned_dtypes: Dict[str, str],
+    profile: Dict[str, Dict[str, Any]],
+) -> pd.DataFrame:
+    savings = pd.DataFrame(
+        [
+            {
+                "column": column,
+                "dtype": dtypes[column],
+                "planned_dtype": planned_dtypes[column],
+                "min": p["min"],
+                "max": p["max"],
+                "bytes": p["rows"]
+                * get_bytes_per_value(dtypes[column], p["missing"] > 0),
+                "planned_bytes": p["rows"]
+                * get_bytes_per_value(planned_dtypes[column], p["missing"] > 0),
+            }
+            for column, p in profile.items()
+            if column in dtypes
+        ]
+    )
+    savings["saved_bytes"] = savings["bytes"] - savings["planned_bytes"]
+    return savings.sort_values("saved_bytes", ascending=False, ignore_index=True)
@@ -0,0 +1,133 @@
+from functools import reduce
+from time import perf_counter
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# A condition is either a predicate `[column, operator, value]` or a mapping of
+# `all` / `any` to a list of conditions, so `pipeline.yaml` can declare filters
+# which compile to arrow expressions and are pushed down to the parquet reader
+
+
+def _not_equal(field: Any, value: Any) -> Any:
+    # match pandas which treats missing values as not equal to anything
+    return pc.or_kleene(pc.not_equal(field, value), pc.is_null(field))
+
+
+def _is_in(field: Any, value: Any) -> Any:
+    return pc.is_in(field, value_set=pa.array(value))
+
+
+def _is_not_in(field: Any, value: Any) -> Any:
+    return pc.or_kleene(pc.invert(_is_in(field, value)), pc.is_null(field))
+
+
+_OPERATORS = {
+    "==": pc.equal,
+    "!=": _not_equal,
+    "<": pc.less,
+    "<=": pc.less_equal,
+    ">": pc.greater,
+    ">=": pc.greater_equal,
+    "in": _is_in,
+    "not in": _is_not_in,
+}
+
+
+def _get_value(value: Any, dtype: pa.DataType) -> Any:
+    # compare floats at column precision as pandas does, otherwise 0.15 <= 0.15
+    # is False for a float32 column
+    if pa.types.is_floating(dtype) and not isinstance(value, list):
+        return pa.scalar(value, type=dtype)
+    else:
+        return value
+
+
+def compile_condition(
+    condition: Any, schema: pa.Schema, field: Callable[[str], Any] = ds.field
+) -> Any:
+    if isinstance(condition, dict):
+        ((how, conditions),) = condition.items()
+        combine = {"all": pc.and_kleene, "any": pc.or_kleene}[how]
+        return reduce(
+            combine, [compile_condition(c, schema, field) for c in conditions]
+        )
+    else:
+        column, operator, value = condition
+        dtype = schema.field(column).type
+        return _OPERATORS[operator](field(column), _get_value(value, dtype))
+
+
+def compile_conditions(
+    conditions: List[Any], schema: pa.Schema, field: Callable[[str], Any] = ds.field
+) -> Any:
+    return compile_condition({"all": conditions}, schema=schema, field=field)
+
+
+def get_condition_columns(conditions: List[Any]) -> List[str]:
+    columns = []
+    for condition in conditions:
+        if isinstance(condition, dict):
+            (nested_conditions,) = condition.values()
+            columns += get_condition_columns(nested_conditions)
+        else:
+            columns.append(condition[0])
+    return list(dict.fromkeys(columns))
+
+
+def format_condition(condition: Any) -> str:
+    if isinstance(condition, dict):
+        ((how, conditions),) = condition.items()
+        separator = {"all": " and ", "any": " or "}[how]
+        return separator.join(format_condition(c) for c in conditions)
+    else:
+        column, operator, value = condition
+        if isinstance(value, list):
+            value = f"[{len(value)} values]"
+        else:
+            value = repr(value)
+        return f"{column} {operator} {value}"
+
+
+def profile_conditions(
+    conditions: List[Any], batches: Iterable[pa.RecordBatch]
+) -> Dict[str, Any]:
+    total = 0
+    rejected = np.zeros(len(conditions), dtype="int64")
+    rejected_cumulatively = np.zeros(len(conditions), dtype="int64")
+    seconds = np.zeros(len(conditions), dtype="float64")
+    for batch in batches:
+        total += batch.num_rows
+        remaining = np.ones(batch.num_rows, dtype="bool")
+        for i, condition in enumerate(conditions):
+            start = perf_counter()
+            mask = (
+                compile_condition(condition, schema=batch.schema, field=batch.column)
+                .fill_null(False)
+                .to_numpy(zero_copy_only=False)
+            )
+            seconds[i] += perf_counter() - start
+            rejected[i] += np.count_nonzero(~mask)
+            rejected_cumulatively[i] += np.count_nonzero(remaining & ~mask)
+            remaining &= mask
+
+    return {
+        "total": total,
+        "remaining": int(total - rejected_cumulatively.sum()),
+        "conditions": [
+            {
+                "condition": format_condition(condition),
+                "rejected": int(rejected[i]),
+                "rejected_cumulatively": int(rejected_cumulatively[i]),
+                "seconds": float(seconds[i]),
+            }
+            for i, condition in enumerate(conditions)
+        ],
+    }
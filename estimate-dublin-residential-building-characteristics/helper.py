@@ -1,10 +1,35 @@
 from csv import QUOTE_NONE
+from functools import lru_cache
+import hashlib
+import json
+from os import PathLike
 from pathlib import Path
 from shutil import unpack_archive
+from time import monotonic
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
 from zipfile import ZipFile
 
 import dask.dataframe as dd
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from archetypes import ARCHETYPE_COLUMNS
+from archetypes import build_archetype_index
+from archetypes import find_archetypes
+from dtypes import get_pandas_dtype
+from filters import compile_conditions
+
+_STAT_INTERVAL = 1.0  # seconds
+_checked_modification_times: Dict[Tuple[str, str], Tuple[float, Tuple[int, ...]]] = {}
 
 
 def _read_bers_via_dask(filepath, **kwargs):
@@ -16,7 +41,7 @@ def _read_bers_via_dask(filepath, **kwargs):
         sep="\t",
         encoding="latin-1",
         quoting=QUOTE_NONE,
-        **kwargs
+        **kwargs,
     )
 
 
@@ -28,10 +53,289 @@ def _read_bers_via_pandas(filepath, **kwargs):
             )
 
 
+def _get_arrow_type(dtype: str) -> pa.DataType:
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    # nullable pandas types like UInt8 are stored as their numpy equivalents
+    pandas_dtype = pd.api.types.pandas_dtype(dtype)
+    return pa.from_numpy_dtype(getattr(pandas_dtype, "numpy_dtype", pandas_dtype))
+
+
+def get_arrow_schema(dtypes: Dict[str, str]) -> pa.Schema:
+    return pa.schema(
+        [pa.field(c, _get_arrow_type(dtype)) for c, dtype in dtypes.items()]
+    )
+
+
+def _get_sidecar_filepath(filepath, usecols, dtype):
+    # the zip directory stores a crc of BERPublicsearch.txt so a changed export
+    # gets a new sidecar without hashing the whole archive
+    with ZipFile(filepath, "r") as zf:
+        info = zf.getinfo("BERPublicsearch.txt")
+    options = json.dumps(
+        {"usecols": sorted(usecols) if usecols else None, "dtype": dtype},
+        sort_keys=True,
+    )
+    options_hash = hashlib.md5(options.encode()).hexdigest()[:8]
+    key = f"{info.CRC:08x}{info.file_size:x}-{options_hash}"
+    return Path(filepath).with_name(f"BERPublicsearch-{key}.parquet")
+
+
+def _read_bers_via_arrow(filepath, usecols=None, dtype=None):
+    sidecar_filepath = _get_sidecar_filepath(filepath, usecols=usecols, dtype=dtype)
+    if not sidecar_filepath.exists():
+        with ZipFile(filepath, "r") as zf:
+            with zf.open("BERPublicsearch.txt", "r") as f:
+                table = csv.read_csv(
+                    f,
+                    read_options=csv.ReadOptions(encoding="latin-1", use_threads=True),
+                    parse_options=csv.ParseOptions(delimiter="\t", quote_char=False),
+                    convert_options=csv.ConvertOptions(
+                        include_columns=list(usecols) if usecols else None,
+                        column_types=get_arrow_schema(dtype) if dtype else None,
+                        strings_can_be_null=True,
+                    ),
+                )
+        # write then rename so an interrupted write is never mistaken for a cache
+        partial_filepath = sidecar_filepath.with_suffix(".partial")
+        pq.write_table(table, partial_filepath)
+        partial_filepath.rename(sidecar_filepath)
+    return pq.read_table(sidecar_filepath, memory_map=True).to_pandas(
+        types_mapper=get_pandas_dtype
+    )
+
+
 def read_bers(filepath, how="pandas", **kwargs):
     _read_map = {
         "pandas": _read_bers_via_pandas,
         "dask": _read_bers_via_dask,
+        "arrow": _read_bers_via_arrow,
     }
     _read = _read_map[how]
     return _read(filepath, **kwargs)
+
+
+def read_estimated_buildings(
+    dirpath: PathLike,
+    columns: Optional[List[str]] = None,
+    small_areas: Optional[List[str]] = None,
+    local_authorities: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    buildings = ds.dataset(dirpath, format="parquet", partitioning="hive")
+    conditions = []
+    if small_areas is not None:
+        conditions.append(["small_area", "in", list(small_areas)])
+    if local_authorities is not None:
+        conditions.append(["local_authority", "in", list(local_authorities)])
+    if conditions:
+        filter_expression = compile_conditions(conditions, schema=buildings.schema)
+    else:
+        filter_expression = None
+    return buildings.to_table(columns=columns, filter=filter_expression).to_pandas(
+        types_mapper=get_pandas_dtype
+    )
+
+
+def _get_archetype_filepaths(
+    archetypes_dirpath: PathLike,
+    small_area_electoral_district_id_map_filepath: PathLike,
+) -> List[Path]:
+    return [
+        Path(archetypes_dirpath) / ("_".join(columns) + ".csv")
+        for columns in ARCHETYPE_COLUMNS
+    ] + [Path(small_area_electoral_district_id_map_filepath)]
+
+
+def _get_modification_times(
+    archetypes_dirpath: str,
+    small_area_electoral_district_id_map_filepath: str,
+) -> Tuple[int, ...]:
+    # cached lookups are keyed on these so that a rebuilt pipeline is reloaded, they
+    # are rechecked at most every _STAT_INTERVAL seconds so that a loop of lookups
+    # doesn't stat every file on every lookup
+    key = (archetypes_dirpath, small_area_electoral_district_id_map_filepath)
+    checked_at, modification_times = _checked_modification_times.get(key, (None, None))
+    now = monotonic()
+    if checked_at is None or now - checked_at > _STAT_INTERVAL:
+        filepaths = _get_archetype_filepaths(*key)
+        modification_times = tuple(f.stat().st_mtime_ns for f in filepaths)
+        _checked_modification_times[key] = (now, modification_times)
+    return modification_times
+
+
+@lru_cache(maxsize=4)
+def _load_archetype_lookup(
+    archetypes_dirpath: str,
+    small_area_electoral_district_id_map_filepath: str,
+    modification_times: Tuple[int, ...],
+) -> Dict[str, Any]:
+    # every (small_area, period_built) is resolved up front into a dense table of
+    # archetype positions so that a lookup is two hash lookups & an array index,
+    # unknown buildings have no countyname so this level is never used for them
+    filepaths = _get_archetype_filepaths(
+        archetypes_dirpath, small_area_electoral_district_id_map_filepath
+    )
+    archetypes = [
+        (columns, pd.read_csv(filepath, dtype={c: str for c in columns}))
+        for columns, filepath in zip(ARCHETYPE_COLUMNS, filepaths)
+    ]
+    archetype_index = build_archetype_index(
+        [(c, table.dropna(subset=["countyname"])) for c, table in archetypes]
+    )
+    with open(filepaths[-1], "r") as f:
+        small_area_electoral_district_id_map = json.load(f)
+
+    small_areas = pd.Index(list(small_area_electoral_district_id_map)).union(
+        archetypes[0][1]["small_area"].dropna().unique(), sort=False
+    )
+    periods_built = pd.Index(
+        pd.concat([table["period_built"] for _, table in archetypes]).dropna().unique()
+    )
+
+    # the last row is for small areas which are not in the map
+    n_small_areas = len(small_areas) + 1
+    n_periods_built = len(periods_built)
+    grid_small_areas = pd.Series(
+        np.repeat(
+            np.append(small_areas.to_numpy(dtype="object"), None), n_periods_built
+        )
+    )
+    grid = pd.DataFrame(
+        {
+            "small_area": grid_small_areas,
+            "cso_ed_id": grid_small_areas.map(small_area_electoral_district_id_map),
+            "countyname": None,
+            "period_built": np.tile(periods_built.to_numpy(), n_small_areas),
+        }
+    )
+    positions = find_archetypes(archetype_index, buildings=grid)
+
+    # a row of missing values is appended for buildings without an archetype, whose
+    # position of -1 indexes the last row
+    table = archetype_index["archetypes"]
+    table = table.reindex(np.arange(len(table) + 1))
+
+    return {
+        "small_areas": small_areas,
+        "periods_built": periods_built,
+        "positions": positions.reshape(n_small_areas, n_periods_built),
+        "columns": {c: table[c].to_numpy() for c in table.columns},
+    }
+
+
+def _read_archetype_lookup(
+    archetypes_dirpath: PathLike,
+    small_area_electoral_district_id_map_filepath: PathLike,
+) -> Dict[str, Any]:
+    archetypes_dirpath = str(archetypes_dirpath)
+    small_area_electoral_district_id_map_filepath = str(
+        small_area_electoral_district_id_map_filepath
+    )
+    return _load_archetype_lookup(
+        archetypes_dirpath,
+        small_area_electoral_district_id_map_filepath,
+        _get_modification_times(
+            archetypes_dirpath, small_area_electoral_district_id_map_filepath
+        ),
+    )
+
+
+def _find_positions(
+    lookup: Dict[str, Any],
+    small_areas: Iterable[str],
+    periods_built: Iterable[str],
+) -> np.ndarray:
+    small_area_codes = lookup["small_areas"].get_indexer(
+        pd.Index(small_areas, dtype="object")
+    )
+    period_built_codes = lookup["periods_built"].get_indexer(
+        pd.Index(periods_built, dtype="object")
+    )
+    small_area_codes[small_area_codes == -1] = len(lookup["small_areas"])
+    return np.where(
+        period_built_codes == -1,
+        -1,
+        lookup["positions"][small_area_codes, period_built_codes],
+    )
+
+
+def _find_position(
+    lookup: Dict[str, Any],
+    small_area: str,
+    period_built: str,
+) -> int:
+    try:
+        period_built_code = lookup["periods_built"].get_loc(period_built)
+    except KeyError:
+        return -1
+    try:
+        small_area_code = lookup["small_areas"].get_loc(small_area)
+    except KeyError:
+        small_area_code = len(lookup["small_areas"])
+    return lookup["positions"][small_area_code, period_built_code]
+
+
+def get_archetypes(
+    archetypes_dirpath: PathLike,
+    small_area_electoral_district_id_map_filepath: PathLike,
+    small_areas: Iterable[str],
+    periods_built: Iterable[str],
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    lookup = _read_archetype_lookup(
+        archetypes_dirpath, small_area_electoral_district_id_map_filepath
+    )
+    positions = _find_positions(lookup, small_areas, periods_built)
+    if columns is None:
+        columns = list(lookup["columns"])
+    # taking each column's array is far quicker than reindexing the table, a
+    # building without an archetype is a row of missing values
+    return pd.DataFrame(
+        {c: lookup["columns"][c][positions] for c in columns}, copy=False
+    )
+
+
+@lru_cache(maxsize=65536)
+def _get_archetype(
+    archetypes_dirpath: str,
+    small_area_electoral_district_id_map_filepath: str,
+    modification_times: Tuple[int, ...],
+    small_area: str,
+    period_built: str,
+) -> Optional[pd.Series]:
+    lookup = _load_archetype_lookup(
+        archetypes_dirpath,
+        small_area_electoral_district_id_map_filepath,
+        modification_times,
+    )
+    position = _find_position(lookup, small_area, period_built)
+    if position == -1:
+        return None
+    return pd.Series(
+        [values[position] for values in lookup["columns"].values()],
+        index=list(lookup["columns"]),
+        dtype="object",
+    )
+
+
+def get_archetype(
+    archetypes_dirpath: PathLike,
+    small_area_electoral_district_id_map_filepath: PathLike,
+    small_area: str,
+    period_built: str,
+) -> Optional[pd.Series]:
+    archetypes_dirpath = str(archetypes_dirpath)
+    small_area_electoral_district_id_map_filepath = str(
+        small_area_electoral_district_id_map_filepath
+    )
+    archetype = _get_archetype(
+        archetypes_dirpath,
+        small_area_electoral_district_id_map_filepath,
+        _get_modification_times(
+            archetypes_dirpath, small_area_electoral_district_id_map_filepath
+        ),
+        small_area,
+        period_built,
+    )
+    # a copy so that callers can't modify the cached archetype
+    return None if archetype is None else archetype.copy()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+from os import PathLike
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from matching import encode_groups
+from matching import get_group_ordinals
+
+# A refresh of BERPublicsearch changes few rows, so rows are hashed and only the
+# groups containing rows which were added, removed or reordered are recomputed,
+# everything else is patched in from the previous snapshot.  Snapshots & changes
+# record the version of the rows they were computed from, so changes are only
+# patched into a snapshot of the version which they change
+
+VERSIONS_KEY = b"incremental_versions"
+
+
+def hash_rows(df: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def hash_grouped_rows(df: pd.DataFrame, on: List[str]) -> pd.DataFrame:
+    # a row's position within its group decides its match so it is hashed too
+    (groups,), _ = encode_groups([df], on=on)
+    row_hashes = hash_rows(df.assign(id=get_group_ordinals(groups)))
+    return df[on].astype(str).where(df[on].notnull()).assign(row_hash=row_hashes)
+
+
+def get_changed_groups(
+    previous: pd.DataFrame, current: pd.DataFrame, on: List[str]
+) -> pd.DataFrame:
+    # a row hash whose count differs between snapshots marks its group as changed
+    hashes = np.concatenate([previous["row_hash"], current["row_hash"]])
+    weights = np.concatenate([-np.ones(len(previous)), np.ones(len(current))])
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    is_changed_hash = np.bincount(inverse, weights=weights) != 0
+    is_changed_row = is_changed_hash[inverse]
+    changed_groups = (
+        pd.concat([previous[on], current[on]], ignore_index=True)
+        .loc[is_changed_row]
+        .dropna()
+        .drop_duplicates()
+        .astype(str)
+        .reset_index(drop=True)
+    )
+    return changed_groups
+
+
+def is_in_groups(df: pd.DataFrame, groups: pd.DataFrame, on: List[str]) -> np.ndarray:
+    (df_groups, selected_groups), _ = encode_groups(
+        [df[on].astype(str), groups[on].astype(str)], on=on
+    )
+    return (df_groups != -1) & np.isin(df_groups, selected_groups)
+
+
+def patch_groups(
+    previous: pd.DataFrame,
+    recomputed: pd.DataFrame,
+    groups: pd.DataFrame,
+    on: List[str],
+) -> pd.DataFrame:
+    unchanged = previous[~is_in_groups(previous, groups=groups, on=on)]
+    return pd.concat([unchanged, recomputed], ignore_index=True)
+
+
+def get_version(*row_hashes: pd.DataFrame) -> str:
+    md5 = hashlib.md5()
+    for hashes in row_hashes:
+        md5.update(hashes["row_hash"].to_numpy().tobytes())
+    return md5.hexdigest()
+
+
+def write_versioned_parquet(
+    df: pd.DataFrame, filepath: PathLike, **versions: Optional[str]
+) -> None:
+    table = pa.Table.from_pandas(df)
+    metadata = {**(table.schema.metadata or {}), VERSIONS_KEY: json.dumps(versions)}
+    pq.write_table(table.replace_schema_metadata(metadata), filepath)
+
+
+def read_versions(filepath: PathLike) -> Dict[str, Optional[str]]:
+    # a file written before versions were recorded has none
+    metadata = pq.read_schema(filepath).metadata or {}
+    return json.loads(metadata.get(VERSIONS_KEY, b"{}"))
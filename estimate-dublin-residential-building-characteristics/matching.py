@@ -0,0 +1,115 @@
+from functools import reduce
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def _has_shared_categories(frames: List[pd.DataFrame], column: str) -> bool:
+    dtypes = [f[column].dtype for f in frames]
+    return all(isinstance(d, pd.CategoricalDtype) for d in dtypes) and all(
+        d.categories.equals(dtypes[0].categories) for d in dtypes[1:]
+    )
+
+
+def _get_level(frames: List[pd.DataFrame], column: str) -> pd.Index:
+    # columns of the same categories (like small areas coded by their keys) are
+    # grouped on their codes as they are, other columns are coded on the fly
+    if _has_shared_categories(frames, column):
+        return frames[0][column].cat.categories
+    return reduce(
+        pd.Index.union,
+        [pd.Index(np.asarray(f[column].dropna().unique())) for f in frames],
+    )
+
+
+def _get_codes(values: pd.Series, level: pd.Index) -> np.ndarray:
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.equals(
+        level
+    ):
+        return values.cat.codes.to_numpy().astype("int64")
+    return pd.Categorical(values, categories=level).codes.astype("int64")
+
+
+def encode_groups(
+    frames: List[pd.DataFrame], on: List[str]
+) -> Tuple[List[np.ndarray], List[pd.Index]]:
+    levels = [_get_level(frames, c) for c in on]
+    sizes = [len(level) for level in levels]
+
+    frame_groups = []
+    for f in frames:
+        column_codes = [_get_codes(f[c], level) for c, level in zip(on, levels)]
+        is_missing = np.logical_or.reduce([codes == -1 for codes in column_codes])
+        groups = np.ravel_multi_index(
+            [np.where(is_missing, 0, codes) for codes in column_codes], dims=sizes
+        ).astype("int64")
+        groups[is_missing] = -1
+        frame_groups.append(groups)
+
+    return frame_groups, levels
+
+
+def decode_groups(
+    groups: np.ndarray, levels: List[pd.Index], on: List[str]
+) -> pd.DataFrame:
+    column_codes = np.unravel_index(groups, shape=[len(level) for level in levels])
+    return pd.DataFrame(
+        {c: level.take(codes) for c, level, codes in zip(on, levels, column_codes)}
+    )
+
+
+def get_group_ordinals(groups: np.ndarray) -> np.ndarray:
+    # equivalent to groupby().cumcount() + 1, rows keep their order within groups
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    is_group_start = np.empty(len(groups), dtype="bool")
+    is_group_start[:1] = True
+    is_group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    group_starts = np.maximum.accumulate(
+        np.where(is_group_start, np.arange(len(groups)), 0)
+    )
+    ordinals = np.empty(len(groups), dtype="int64")
+    ordinals[order] = np.arange(len(groups)) - group_starts + 1
+    return ordinals
+
+
+def match_within_groups(
+    left_groups: np.ndarray,
+    right_groups: np.ndarray,
+    right_is_candidate: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    left_ordinals = get_group_ordinals(left_groups)
+    right_ordinals = get_group_ordinals(right_groups)
+
+    # pack (group, ordinal) into a single int64 so the join is one hash lookup
+    stride = max(left_ordinals.max(initial=0), right_ordinals.max(initial=0)) + 1
+    left_keys = np.where(left_groups == -1, -1, left_groups * stride + left_ordinals)
+    right_keys = right_groups * stride + right_ordinals
+
+    is_candidate = right_groups != -1
+    if right_is_candidate is not None:
+        is_candidate &= right_is_candidate
+    candidates = np.flatnonzero(is_candidate)
+    candidate_indexer = pd.Index(right_keys[candidates]).get_indexer(left_keys)
+    is_found = candidate_indexer != -1
+    indexer = np.full(len(left_groups), -1, dtype="int64")
+    indexer[is_found] = candidates[candidate_indexer[is_found]]
+
+    return left_ordinals, right_ordinals, indexer
+
+
+def summarise_matches(
+    groups: np.ndarray, indexer: np.ndarray, levels: List[pd.Index], on: List[str]
+) -> pd.DataFrame:
+    n_groups = int(np.prod([len(level) for level in levels]))
+    is_known = groups != -1
+    total = np.bincount(groups[is_known], minlength=n_groups)
+    matched = np.bincount(groups[is_known & (indexer != -1)], minlength=n_groups)
+    nonempty_groups = np.flatnonzero(total)
+    matches = decode_groups(nonempty_groups, levels=levels, on=on)
+    matches["total"] = total[nonempty_groups]
+    matches["matched"] = matched[nonempty_groups]
+    return matches
@@ -0,0 +1,90 @@
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from codema_dev_shared.modes import decode_modal_codes
+from codema_dev_shared.modes import get_grouped_modal_codes
+from codema_dev_shared.modes import get_value_codes
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# Rather than the median & mode of every observed building in its archetype, each
+# unknown building takes the median & mode of the k observed buildings nearest to
+# it in a space of standardised features.  Neighbours are found with a KD-tree
+# & filled in batches of queries so that each batch is a handful of array ops
+
+
+def standardise_features(
+    observed: np.ndarray, queries: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # queries are scaled like the observed buildings so distances are comparable
+    mean = observed.mean(axis=0)
+    std = observed.std(axis=0)
+    std[std == 0] = 1
+    return (observed - mean) / std, (queries - mean) / std
+
+
+def encode_neighbour_values(
+    buildings: pd.DataFrame, columns: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    numeric_columns = buildings[columns].select_dtypes("number").columns
+    categorical_columns = (
+        buildings[columns].select_dtypes(["object", "string", "category"]).columns
+    )
+    values: Dict[str, Dict[str, Any]] = {}
+    for column in columns:
+        if column in numeric_columns:
+            values[column] = {
+                "is_numeric": True,
+                "values": buildings[column].to_numpy(dtype="float64", na_value=np.nan),
+                "dtype": buildings[column].dtype,
+            }
+        elif column in categorical_columns:
+            codes, uniques = get_value_codes(buildings[column])
+            values[column] = {"is_numeric": False, "codes": codes, "uniques": uniques}
+    return values
+
+
+def _get_row_medians(values: np.ndarray) -> np.ndarray:
+    # missing values sort last so each row's first n_known values are its known ones,
+    # & like the archetypes an even count is the mean of its two middle values
+    values = np.sort(values, axis=1)
+    n_known = np.count_nonzero(~np.isnan(values), axis=1)
+    rows = np.arange(len(values))
+    lower = values[rows, np.maximum(n_known - 1, 0) // 2]
+    upper = values[rows, np.minimum(n_known // 2, values.shape[1] - 1)]
+    return np.where(n_known == 0, np.nan, (lower + upper) / 2)
+
+
+def impute_from_neighbours(
+    queries: np.ndarray,
+    tree: cKDTree,
+    values: Dict[str, Dict[str, Any]],
+    k: int,
+    workers: int = 1,
+) -> pd.DataFrame:
+    if k < 1:
+        raise ValueError(f"k must be at least 1, not {k}")
+    n_queries = len(queries)
+    _, neighbours = tree.query(queries, k=k, workers=workers)
+    neighbours = neighbours.reshape(n_queries, k)
+    query_of_neighbour = np.repeat(np.arange(n_queries), k)
+
+    imputed = {}
+    for column, v in values.items():
+        if v["is_numeric"]:
+            medians = _get_row_medians(v["values"][neighbours])
+            if pd.api.types.is_float_dtype(v["dtype"]):
+                medians = medians.astype(v["dtype"])
+            imputed[column] = medians
+        else:
+            modal_codes = get_grouped_modal_codes(
+                query_of_neighbour,
+                codes=v["codes"][neighbours].ravel(),
+                n_groups=n_queries,
+                n_codes=len(v["uniques"]),
+            )
+            imputed[column] = decode_modal_codes(modal_codes, v["uniques"])
+    return pd.DataFrame(imputed)
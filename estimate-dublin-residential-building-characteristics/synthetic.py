@@ -0,0 +1,280 @@
+import json
+from os import PathLike
+from typing import Any
+from typing import Dict
+from typing import List
+from zipfile import ZIP_DEFLATED
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+
+# BERPublicsearch is only available on request so benchmarks run on synthetic data
+# of the same shape: tab-separated latin-1 text of raw SEAI column names, padded
+# categories & empty missing values
+
+PERIODS_BUILT = [
+    ("PRE19", 1700, 1918),
+    ("19_45", 1919, 1945),
+    ("46_60", 1946, 1960),
+    ("61_70", 1961, 1970),
+    ("71_80", 1971, 1980),
+    ("81_90", 1981, 1990),
+    ("91_00", 1991, 2000),
+    ("01_10", 2001, 2010),
+    ("11L", 2011, 2021),
+]
+PERIOD_BUILT_WEIGHTS = [0.08, 0.07, 0.07, 0.08, 0.14, 0.1, 0.15, 0.24, 0.07]
+
+DUBLIN_COUNTYNAMES = ["Co. Dublin"] + [f"Dublin {i}" for i in range(1, 25)]
+OTHER_COUNTYNAMES = [
+    "Co. Cork",
+    "Cork City",
+    "Co. Galway",
+    "Galway City",
+    "Co. Kildare",
+    "Co. Meath",
+    "Co. Wicklow",
+    "Co. Limerick",
+    "Co. Donegal",
+    "Co. Kerry",
+]
+
+CATEGORIES = {
+    "DwellingTypeDescr": [
+        "Mid-terrace house",
+        "End of terrace house",
+        "Semi-detached house",
+        "Detached house",
+        "Apartment",
+        "Ground-floor apartment",
+        "Mid-floor apartment",
+        "Top-floor apartment",
+        "Maisonette",
+        "House",
+    ],
+    "TypeofRating": ["Existing    ", "Final    ", "Provisional    "],
+    "MainSpaceHeatingFuel": [
+        "Mains Gas",
+        "Heating Oil",
+        "Electricity",
+        "Solid Multi-Fuel",
+        "Bulk LPG (propane or butane)",
+        "Wood Pellets (bulk supply for",
+    ],
+    "MainWaterHeatingFuel": [
+        "Mains Gas",
+        "Heating Oil",
+        "Electricity",
+        "Solid Multi-Fuel",
+        "Bulk LPG (propane or butane)",
+    ],
+    "SupplSHFuel": ["", "Electricity", "Sod Peat", "Wood Logs", "Coal"],
+    "SupplWHFuel": ["", "Electricity"],
+    "DraftLobby": ["NO", "YES"],
+    "SuspendedWoodenFloor": ["No", "Yes (Sealed)", "Yes (Unsealed)"],
+    "StructureType": [
+        "Masonry",
+        "Timber or Steel Frame",
+        "Insulated Conctete Form",
+        "Please select",
+    ],
+    "VentilationMethod": [
+        "Natural vent.",
+        "Bal.whole mech.vent heat recvr",
+        "Pos input vent.- loft",
+        "Whole house extract vent.",
+    ],
+}
+CATEGORY_WEIGHTS = {"TypeofRating": [0.8, 0.15, 0.05]}
+
+# (low, high, fraction missing) of uniformly distributed columns, the rest are
+# gamma distributed about 10
+NUMBERS = {
+    "BerRating": (20, 600, 0),
+    "LivingAreaPercent": (5, 60, 0),
+    "GroundFloorArea": (20, 250, 0),
+    "FirstFloorArea": (0, 150, 0),
+    "SecondFloorArea": (0, 20, 0),
+    "ThirdFloorArea": (0, 5, 0),
+    "GroundFloorHeight": (2.2, 3.2, 0),
+    "FirstFloorHeight": (0, 3, 0),
+    "SecondFloorHeight": (0, 3, 0.5),
+    "ThirdFloorHeight": (0, 3, 0.9),
+    "UValueRoof": (0.1, 2.3, 0),
+    "UValueWall": (0.1, 2.1, 0),
+    "UValueFloor": (0.1, 0.8, 0),
+    "UValueWindow": (0.8, 4.8, 0),
+    "UvalueDoor": (1, 3, 0),
+    "HSMainSystemEfficiency": (19, 400, 0),
+    "WHMainSystemEff": (19, 300, 0),
+    "HSEffAdjFactor": (0.65, 1, 0),
+    "WHEffAdjFactor": (0.65, 1, 0),
+    "HSSupplHeatFraction": (0, 0.2, 0),
+    "DeclaredLossFactor": (0, 21, 0),
+    "ThermalBridgingFactor": (0, 0.15, 0),
+    "NoOfSidesSheltered": (0, 4, 0),
+    "NoOfChimneys": (0, 3, 0.1),
+    "NoOfOpenFlues": (0, 2, 0.1),
+    "NoOfFansAndVents": (0, 6, 0.1),
+    "NoOfFluelessGasFires": (0, 1, 0.1),
+    "PermeabilityTestResult": (1, 15, 0.7),
+    "NoStoreys": (1, 4, 0),
+    "PercentageDraughtStripped": (0, 100, 0),
+    "HeatExchangerEff": (0, 90, 0.9),
+}
+INTEGERS = {"NoOfSidesSheltered", "NoOfChimneys", "NoOfOpenFlues", "NoStoreys"}
+
+# columns which the pipeline never reads but which are in every export
+UNSELECTED = {
+    "EnergyRating": ["A2", "A3", "B1", "B2", "B3", "C1", "C2", "C3", "D1", "D2"],
+    "MPCDERValue": None,
+    "CO2Rating": None,
+}
+
+
+def generate_small_area_ids(n_small_areas: int, n_dublin_small_areas: int) -> List[str]:
+    # some small areas are split in two which makes ids like 268001001/01
+    dublin_small_area_ids = [
+        f"268{i:06d}" + ("/01" if i % 50 == 0 else "")
+        for i in range(n_dublin_small_areas)
+    ]
+    other_small_area_ids = [
+        f"0{17 + i // 1000:02d}{i % 1000:06d}"
+        for i in range(n_small_areas - n_dublin_small_areas)
+    ]
+    return dublin_small_area_ids + other_small_area_ids
+
+
+def _generate_years_of_construction(
+    rng: np.random.Generator, n_rows: int
+) -> np.ndarray:
+    periods = rng.choice(len(PERIODS_BUILT), size=n_rows, p=PERIOD_BUILT_WEIGHTS)
+    lows = np.array([low for _, low, _ in PERIODS_BUILT])[periods]
+    highs = np.array([high for _, _, high in PERIODS_BUILT])[periods]
+    return rng.integers(lows, highs + 1)
+
+
+def generate_building_energy_ratings(
+    rng: np.random.Generator,
+    n_rows: int,
+    columns: List[str],
+    small_area_ids: List[str],
+    n_dublin_small_areas: int,
+) -> pd.DataFrame:
+    small_areas = rng.integers(0, len(small_area_ids), size=n_rows)
+    is_dublin = small_areas < n_dublin_small_areas
+    bers: Dict[str, Any] = {}
+    for column in columns:
+        if column == "SA_Code":
+            values = np.asarray(small_area_ids, dtype="object")[small_areas]
+        elif column == "CountyName":
+            values = np.where(
+                is_dublin,
+                rng.choice(DUBLIN_COUNTYNAMES, size=n_rows),
+                rng.choice(OTHER_COUNTYNAMES, size=n_rows),
+            )
+        elif column == "Year_of_Construction":
+            values = _generate_years_of_construction(rng, n_rows)
+        elif column in CATEGORIES:
+            values = rng.choice(
+                CATEGORIES[column], size=n_rows, p=CATEGORY_WEIGHTS.get(column)
+            )
+        elif column in NUMBERS:
+            low, high, fraction_missing = NUMBERS[column]
+            if column in INTEGERS:
+                values = rng.integers(low, high + 1, size=n_rows).astype("float64")
+            else:
+                values = rng.uniform(low, high, size=n_rows).round(3)
+            values[rng.random(n_rows) < fraction_missing] = np.nan
+        else:
+            values = rng.gamma(2, 5, size=n_rows).round(3)
+        bers[column] = values
+
+    for column, categories in UNSELECTED.items():
+        if categories is None:
+            bers[column] = rng.gamma(2, 50, size=n_rows).round(2)
+        else:
+            bers[column] = rng.choice(categories, size=n_rows)
+
+    return pd.DataFrame(bers)
+
+
+def write_building_energy_ratings(
+    filepath: PathLike,
+    n_rows: int,
+    seed: int,
+    columns: List[str],
+    small_area_ids: List[str],
+    n_dublin_small_areas: int,
+    chunksize: int = 250_000,
+) -> None:
+    # each chunk is seeded by its position so that the output only depends on seed,
+    # the census is seeded by [seed, 0]
+    with ZipFile(filepath, "w", compression=ZIP_DEFLATED) as zf:
+        with zf.open("BERPublicsearch.txt", "w", force_zip64=True) as f:
+            for i, start in enumerate(range(0, n_rows, chunksize)):
+                bers = generate_building_energy_ratings(
+                    np.random.default_rng([seed, i + 1]),
+                    n_rows=min(chunksize, n_rows - start),
+                    columns=columns,
+                    small_area_ids=small_area_ids,
+                    n_dublin_small_areas=n_dublin_small_areas,
+                )
+                text = bers.to_csv(sep="\t", index=False, header=i == 0)
+                f.write(text.encode("latin-1"))
+
+
+def generate_census_buildings(
+    rng: np.random.Generator, n_rows: int, small_area_ids: List[str]
+) -> pd.DataFrame:
+    periods_built = [period_built for period_built, _, _ in PERIODS_BUILT]
+    return pd.DataFrame(
+        {
+            "small_area": rng.choice(small_area_ids, size=n_rows),
+            "period_built": rng.choice(
+                periods_built, size=n_rows, p=PERIOD_BUILT_WEIGHTS
+            ),
+        }
+    ).sort_values("small_area", ignore_index=True)
+
+
+def write_synthetic_inputs(
+    filepaths: Dict[str, PathLike],
+    n_rows: int,
+    seed: int,
+    ber_columns: List[str],
+    n_small_areas: int = 18641,
+    n_dublin_small_areas: int = 4881,
+    n_small_areas_per_electoral_district: int = 15,
+) -> None:
+    small_area_ids = generate_small_area_ids(n_small_areas, n_dublin_small_areas)
+
+    write_building_energy_ratings(
+        filepaths["download_building_energy_ratings"],
+        n_rows=n_rows,
+        seed=seed,
+        columns=ber_columns,
+        small_area_ids=small_area_ids,
+        n_dublin_small_areas=n_dublin_small_areas,
+    )
+
+    census = generate_census_buildings(
+        np.random.default_rng([seed, 0]), n_rows=n_rows, small_area_ids=small_area_ids
+    )
+    census.to_csv(
+        filepaths["download_census_building_ages"],
+        index=False,
+        compression={"method": "zip", "archive_name": "census_buildings.csv"},
+    )
+
+    pd.Series(small_area_ids[:n_dublin_small_areas], name="small_area").to_csv(
+        filepaths["download_dublin_small_area_ids"], index=False
+    )
+
+    small_area_electoral_district_id_map = {
+        small_area_id: f"{i // n_small_areas_per_electoral_district:05d}"
+        for i, small_area_id in enumerate(small_area_ids)
+    }
+    with open(filepaths["download_small_area_electoral_district_id_map"], "w") as f:
+        json.dump(small_area_electoral_district_id_map, f)
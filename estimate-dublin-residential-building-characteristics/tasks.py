@@ -1,18 +1,104 @@
+from concurrent.futures import ProcessPoolExecutor
 from csv import QUOTE_NONE
+from functools import partial
+import hashlib
 import json
 from os import PathLike
 from pathlib import Path
+from shutil import rmtree
 from typing import Any
 from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import quote
 from zipfile import ZipFile
 
+from codema_dev_shared.small_area_keys import build_small_area_keys
+from codema_dev_shared.small_area_keys import decode_parent_codes
+from codema_dev_shared.small_area_keys import decode_small_areas
+from codema_dev_shared.small_area_keys import encode_small_areas
+from codema_dev_shared.small_area_keys import get_parent_codes
 import dask.dataframe as dd
+import geopandas as gpd
 import numpy as np
 import pandas as pd
-import requests
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import feather
+import pyarrow.parquet as pq
+from scipy.spatial import cKDTree
 
+from archetypes import aggregate_archetype_values
+from archetypes import ARCHETYPE_COLUMNS
+from archetypes import build_archetype_index
+from archetypes import count_archetype_values
+from archetypes import find_archetypes
+from archetypes import merge_archetype_values
+from archetypes import rollup_archetypes
+from archetypes import sort_categories
+from archetypes import stream_archetypes
+from cluster import get_n_partitions
+from cluster import get_partition_ids
+from cluster import map_partitions
+from cluster import split_rows
+from cluster import start_client
+from column_usage import get_published_columns
+from column_usage import get_required_columns
+from column_usage import report_column_usage
+from download import fetch_file
+from dtypes import get_memory_savings
+from dtypes import get_pandas_dtype
+from dtypes import merge_profiles
+from dtypes import plan_dtypes
+from dtypes import profile_numbers
+from filters import compile_conditions
+from filters import get_condition_columns
+from filters import profile_conditions
+from helper import get_arrow_schema
+from incremental import get_changed_groups
+from incremental import get_version
+from incremental import hash_grouped_rows
+from incremental import is_in_groups
+from incremental import patch_groups
+from incremental import read_versions
+from incremental import write_versioned_parquet
+from matching import encode_groups
+from matching import match_within_groups
+from matching import summarise_matches
+from neighbours import encode_neighbour_values
+from neighbours import impute_from_neighbours
+from neighbours import standardise_features
 
-def download_building_energy_ratings(product: PathLike) -> None:
+COUNTY_CODE_LENGTH = 3
+
+PERIODS_BUILT = [
+    "PRE19",
+    "19_45",
+    "46_60",
+    "61_70",
+    "71_80",
+    "81_90",
+    "91_00",
+    "01_10",
+    "11L",
+]
+
+# the position of each BER in BERPublicsearch.txt, partitioning splits BERs by
+# county so they are sorted on this before they are matched in their original order
+ROW_NUMBER_COLUMN = "row_number"
+
+# columns which locate a building rather than describe it so they are never imputed
+NEIGHBOUR_KEY_COLUMNS = ["small_area", "period_built", "cso_ed_id", "id"]
+
+
+def download_building_energy_ratings(
+    product: PathLike,
+    url: str = "https://ndber.seai.ie/BERResearchTool/ber/search.aspx",
+    sha256: Optional[str] = None,
+) -> None:
     cookies = {
         "ASP.NET_SessionId": "gvb1njrssax1kcmjyzatuf3x",
     }
@@ -45,91 +131,334 @@ def download_building_energy_ratings(product: PathLike) -> None:
         "ctl00$DefaultContent$BERSearch$dfExcelDownlaod$DownloadAllData": "Download All Data",
     }
 
-    response = requests.post(
-        "https://ndber.seai.ie/BERResearchTool/ber/search.aspx",
+    fetch_file(
+        url,
+        product,
+        method="POST",
+        sha256=sha256,
         headers=headers,
         cookies=cookies,
         data=data,
     )
 
-    with open(product, "wb") as f:
-        for chunk in response.iter_content(chunk_size=4096):
-            f.write(chunk)
 
+def keep_timestamp_if_unchanged(product: Any) -> None:
+    # fetch_file leaves the file & its mtime alone if its content is unchanged, so
+    # keep the previous timestamp to not invalidate downstream tasks on later builds
+    timestamp = product.metadata.timestamp
+    if timestamp is not None and Path(str(product)).stat().st_mtime < timestamp:
+        product.prepare_metadata = lambda metadata: {**metadata, "timestamp": timestamp}
 
-def unzip_building_energy_ratings(
-    product: PathLike, upstream: Dict[str, PathLike]
-) -> None:
-    zf = ZipFile(upstream["download_building_energy_ratings"])
-    zf.extractall(product)
+
+def _read_building_energy_ratings_in_chunks(
+    filepath: PathLike, chunksize: int, **kwargs: Any
+) -> Iterator[pd.DataFrame]:
+    with ZipFile(filepath) as zf:
+        with zf.open("BERPublicsearch.txt", "r") as f:
+            yield from pd.read_csv(
+                f,
+                sep="\t",
+                encoding="latin-1",
+                quoting=QUOTE_NONE,
+                chunksize=chunksize,
+                **kwargs,
+            )
+
+
+def _get_partition_dirname(column: str, value: Any) -> str:
+    # hive-style so pyarrow can rebuild the partition column on read
+    if pd.isnull(value):
+        return f"{column}=__HIVE_DEFAULT_PARTITION__"
+    else:
+        return f"{column}={quote(str(value), safe='')}"
+
+
+def _cast_parquet_file(filepath: Path, schema: pa.Schema, batch_size: int) -> None:
+    # cast a batch at a time so a partition is never read whole, then replace the
+    # original so an interrupted cast never leaves a partial partition behind
+    partial_filepath = filepath.with_suffix(".partial")
+    with pq.ParquetFile(filepath) as f, pq.ParquetWriter(
+        partial_filepath, schema=schema
+    ) as writer:
+        for batch in f.iter_batches(batch_size=batch_size):
+            # a safe cast raises rather than truncate so narrowing is lossless
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema, safe=True))
+    partial_filepath.replace(filepath)
 
 
 def save_selected_columns_as_parquet(
-    product: Any, upstream: Any, names: Dict[str, str], dtypes: Dict[str, str]
+    product: Any,
+    upstream: Any,
+    names: Dict[str, str],
+    dtypes: Dict[str, str],
+    partition_on: str,
+    chunksize: int,
+    columns: List[str],
+    conditions: List[Any],
 ) -> None:
-    filepath = Path(upstream["unzip_building_energy_ratings"]) / "BERPublicsearch.txt"
-    building_energy_ratings = pd.read_csv(
-        filepath,
-        sep="\t",
-        encoding="latin-1",
-        quoting=QUOTE_NONE,
-        usecols=names.keys(),
-        dtype=dtypes,
-    ).rename(columns=names)
-    building_energy_ratings.to_parquet(product)
-
-
-def extract_buildings_meeting_conditions(product: Any, upstream: Any) -> None:
-    buildings = pd.read_parquet(upstream["save_selected_columns_as_parquet"])
-    dublin_small_area_ids = pd.read_csv(
-        upstream["download_dublin_small_area_ids"]
-    ).squeeze()
+    dirpath = Path(product["data"])
+    if dirpath.exists():
+        rmtree(dirpath)
+    dirpath.mkdir(parents=True)
+
+    selected_names, selected_dtypes = names, dtypes
+    required_columns = get_required_columns(columns, conditions=conditions)
+    names = {c: name for c, name in names.items() if name in required_columns}
+    dtypes = {c: dtype for c, dtype in dtypes.items() if c in names}
+
+    renamed_dtypes = {names[c]: dtype for c, dtype in dtypes.items()}
+    schema = get_arrow_schema(
+        {c: dtype for c, dtype in renamed_dtypes.items() if c != partition_on}
+    ).append(pa.field(ROW_NUMBER_COLUMN, pa.int64()))
+    # read categories as strings as each chunk would otherwise infer its own
+    # categories, the parquet schema takes care of dictionary encoding
+    chunk_dtypes = {
+        c: "string" if dtype == "category" else dtype for c, dtype in dtypes.items()
+    }
+
+    writers = {}
+    profile = {}
+    small_areas = []
+    n_rows = 0
+    try:
+        chunks = _read_building_energy_ratings_in_chunks(
+            upstream["download_building_energy_ratings"],
+            chunksize=chunksize,
+            usecols=names.keys(),
+            dtype=chunk_dtypes,
+        )
+        for chunk in chunks:
+            chunk = chunk.rename(columns=names)
+            profile = merge_profiles(profile, profile_numbers(chunk))
+            chunk[ROW_NUMBER_COLUMN] = np.arange(n_rows, n_rows + len(chunk))
+            n_rows += len(chunk)
+            small_areas.append(chunk[[partition_on, "small_area"]].drop_duplicates())
+            for value, partition in chunk.groupby(
+                partition_on, dropna=False, observed=True, sort=False
+            ):
+                partition_dirname = _get_partition_dirname(partition_on, value)
+                if partition_dirname not in writers:
+                    partition_dirpath = dirpath / partition_dirname
+                    partition_dirpath.mkdir()
+                    writers[partition_dirname] = pq.ParquetWriter(
+                        partition_dirpath / "part-0.parquet", schema=schema
+                    )
+                table = pa.Table.from_pandas(
+                    partition.drop(columns=partition_on),
+                    schema=schema,
+                    preserve_index=False,
+                )
+                writers[partition_dirname].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    planned_dtypes = plan_dtypes(renamed_dtypes, profile=profile)
+    planned_schema = get_arrow_schema(
+        {c: dtype for c, dtype in planned_dtypes.items() if c != partition_on}
+    ).append(pa.field(ROW_NUMBER_COLUMN, pa.int64()))
+    if planned_schema != schema:
+        for partition_dirname in writers:
+            _cast_parquet_file(
+                dirpath / partition_dirname / "part-0.parquet",
+                schema=planned_schema,
+                batch_size=chunksize,
+            )
+
+    # the small areas in each partition so readers can prune partitions by small area
+    pd.concat(small_areas).drop_duplicates().to_parquet(
+        product["small_areas"], index=False
+    )
+
+    raw_names = {name: c for c, name in names.items()}
+    with open(product["schema"], "w") as f:
+        json.dump(
+            {raw_names[c]: dtype for c, dtype in planned_dtypes.items()}, f, indent=4
+        )
+    savings = get_memory_savings(renamed_dtypes, planned_dtypes, profile=profile)
+    savings.to_csv(product["savings"], index=False)
+    print(
+        f"Planned dtypes save {savings['saved_bytes'].sum() / 2**20:.1f}MB"
+        f" of {savings['bytes'].sum() / 2**20:.1f}MB of numbers"
+    )
+
+    usage = report_column_usage(
+        selected_names,
+        selected_dtypes,
+        columns=columns,
+        conditions=conditions,
+        n_rows=n_rows,
+    )
+    usage.to_csv(product["column_usage"], index=False)
+    unused_columns = usage.query("used_by == 'nothing'")["column"].tolist()
+    print(
+        f"Skipped {len(unused_columns)} unused columns {unused_columns}, avoiding"
+        f" {usage['bytes_avoided'].sum() / 2**20:.1f}MB per intermediate"
+    )
 
-    conditions = [
-        "type_of_rating != 'Provisional    '",
-        "ground_floor_area > 0 and ground_floor_area < 1000",
-        "ground_floor_height > 0",
-        "living_area_percent > 5 or living_area_percent < 90",
-        "main_sh_boiler_efficiency > 19 or main_sh_boiler_efficiency < 600",
-        "main_hw_boiler_efficiency > 19 or main_hw_boiler_efficiency < 320",
-        "main_sh_boiler_efficiency_adjustment_factor > 0.7",
-        "main_hw_boiler_efficiency_adjustment_factor > 0.7",
-        "declared_loss_factor < 20",
-        "thermal_bridging_factor > 0 or thermal_bridging_factor <= 0.15",
-        "small_area in @dublin_small_area_ids",
+
+def _filter_fragment(
+    fragment: ds.Fragment,
+    schema: pa.Schema,
+    columns: List[str],
+    filter_expression: ds.Expression,
+) -> pa.Table:
+    return fragment.to_table(schema=schema, columns=columns, filter=filter_expression)
+
+
+def _write_rejections(
+    filepath: PathLike,
+    buildings: ds.Dataset,
+    conditions: List[Any],
+    profile_rejections: bool,
+) -> None:
+    # profiling rescans every building so is only done if asked for, otherwise the
+    # product is left empty
+    if profile_rejections:
+        rejections = profile_conditions(
+            conditions,
+            batches=buildings.to_batches(columns=get_condition_columns(conditions)),
+        )
+    else:
+        rejections = {}
+    with open(filepath, "w") as f:
+        json.dump(rejections, f, indent=4)
+
+
+def extract_buildings_meeting_conditions(
+    product: Any,
+    upstream: Any,
+    conditions: List[Any],
+    columns: List[str],
+    backend: str,
+    n_workers: int,
+    memory_limit: str,
+    profile_rejections: bool,
+) -> None:
+    buildings = ds.dataset(
+        upstream["save_selected_columns_as_parquet"]["data"],
+        format="parquet",
+        partitioning="hive",
+    )
+    dublin_small_area_ids = (
+        pd.read_csv(upstream["download_dublin_small_area_ids"]).squeeze().astype(str)
+    )
+    # some buildings in Dublin small areas aren't labelled as in a Dublin county, so
+    # partitions are pruned by the small areas they hold rather than by their name
+    small_areas = pq.read_table(
+        upstream["save_selected_columns_as_parquet"]["small_areas"]
+    )
+    dublin_countynames = pc.unique(
+        small_areas.filter(
+            pc.is_in(small_areas["small_area"], pa.array(dublin_small_area_ids))
+        )["countyname"]
+    )
+
+    filter_conditions = conditions + [
+        ["countyname", "in", dublin_countynames.to_pylist()],
+        ["small_area", "in", dublin_small_area_ids.tolist()],
     ]
-    query_str = " and ".join(["(" + c + ")" for c in conditions])
-    buildings_meeting_conditions = buildings.query(query_str)
+    filter_expression = compile_conditions(filter_conditions, schema=buildings.schema)
+    # columns which are only filtered on are not needed downstream
+    published_columns = get_published_columns(columns) + [ROW_NUMBER_COLUMN]
+    with start_client(
+        backend, n_workers=n_workers, memory_limit=memory_limit
+    ) as client:
+        if client is None:
+            table = buildings.to_table(
+                columns=published_columns, filter=filter_expression
+            )
+        else:
+            # fragments are concatenated in the order in which the dataset scans them
+            table = pa.concat_tables(
+                map_partitions(
+                    client,
+                    _filter_fragment,
+                    list(buildings.get_fragments(filter=filter_expression)),
+                    schema=buildings.schema,
+                    columns=published_columns,
+                    filter_expression=filter_expression,
+                )
+            )
+    # categories are in the order the scanned partitions first hold them, so these
+    # are sorted to not depend on which partitions are pruned
+    buildings_meeting_conditions = sort_categories(
+        table.sort_by(ROW_NUMBER_COLUMN)
+        .drop([ROW_NUMBER_COLUMN])
+        .to_pandas(types_mapper=get_pandas_dtype)
+        .astype({"countyname": "category"})
+    )
 
-    total_dublin_buildings = len(buildings[buildings.countyname.str.contains("Dublin")])
+    total_dublin_buildings = buildings.count_rows(
+        filter=pc.match_substring(ds.field("countyname"), "Dublin")
+    )
     print(f"Buildings in Dublin: {total_dublin_buildings}")
     total_buildings_meeting_conditions = len(buildings_meeting_conditions)
     print(f"Buildings meeting conditions: {total_buildings_meeting_conditions}")
 
-    buildings_meeting_conditions.to_parquet(product)
+    _write_rejections(
+        product["rejections"],
+        buildings=buildings,
+        conditions=filter_conditions,
+        profile_rejections=profile_rejections,
+    )
+
+    buildings_meeting_conditions.to_parquet(product["data"])
 
 
 def extract_dublin_census_buildings(product: Any, upstream: Any) -> None:
-    census = pd.read_csv(upstream["download_census_building_ages"])
+    # small area ids are read as strings as only some are split (268001001/01)
+    census = pd.read_csv(
+        upstream["download_census_building_ages"], dtype={"small_area": str}
+    )
     dublin_small_area_ids = pd.read_csv(
-        upstream["download_dublin_small_area_ids"]
+        upstream["download_dublin_small_area_ids"], dtype=str
     ).squeeze()
     dublin_census = census.query("small_area in @dublin_small_area_ids")
     dublin_census.to_parquet(product)
 
 
-def fill_census_with_bers(product: Any, upstream: Any) -> None:
-    census = pd.read_parquet(upstream["extract_dublin_census_buildings"])
-    bers = pd.read_parquet(upstream["extract_buildings_meeting_conditions"])
+def create_small_area_keys(product: Any, upstream: Any) -> None:
+    # codes are only used within this pipeline, small areas are written as ids
+    dublin_small_area_ids = pd.read_csv(
+        upstream["download_dublin_small_area_ids"], dtype=str
+    ).squeeze()
     with open(upstream["download_small_area_electoral_district_id_map"], "r") as f:
         small_area_electoral_district_id_map = json.load(f)
+    small_areas = pd.DataFrame(
+        {
+            "small_area": dublin_small_area_ids,
+            "cso_ed_id": dublin_small_area_ids.map(
+                small_area_electoral_district_id_map
+            ),
+        }
+    )
+    small_area_keys = build_small_area_keys(small_areas, parent_levels=["cso_ed_id"])
+    small_area_keys.to_parquet(product)
 
-    merge_columns = ["small_area", "period_built"]
 
-    census["id"] = census.groupby(merge_columns).cumcount().apply(lambda x: x + 1)
+def _encode_small_areas(
+    small_areas: pd.Series, small_area_keys: pd.DataFrame
+) -> pd.Series:
+    # a categorical of the keys' ids holds their codes, so buildings are matched &
+    # grouped on these codes & the ids are only decoded when written
+    codes = encode_small_areas(small_areas, small_area_keys)
+    return decode_small_areas(codes, small_area_keys).set_axis(small_areas.index)
+
+
+def _get_electoral_districts(
+    small_areas: pd.Series, small_area_keys: pd.DataFrame
+) -> pd.Series:
+    codes = encode_small_areas(small_areas, small_area_keys)
+    parent_codes = get_parent_codes(codes, small_area_keys, "cso_ed_id")
+    return decode_parent_codes(parent_codes, small_area_keys, "cso_ed_id").set_axis(
+        small_areas.index
+    )
+
 
-    bers["period_built"] = pd.cut(
-        bers["year_of_construction"],
+def _get_period_built(year_of_construction: pd.Series) -> pd.Series:
+    return pd.cut(
+        year_of_construction,
         bins=[
             -np.inf,
             1919,
@@ -142,118 +471,895 @@ def fill_census_with_bers(product: Any, upstream: Any) -> None:
             2011,
             np.inf,
         ],
-        labels=[
-            "PRE19",
-            "19_45",
-            "46_60",
-            "61_70",
-            "71_80",
-            "81_90",
-            "91_00",
-            "01_10",
-            "11L",
-        ],
+        labels=PERIODS_BUILT,
+    )
+
+
+def _match_census_with_bers(census: pd.DataFrame, bers: pd.DataFrame) -> Any:
+    merge_columns = ["small_area", "period_built"]
+
+    (census_groups, ber_groups), levels = encode_groups(
+        [census, bers], on=merge_columns
+    )
+    census["id"], bers["id"], indexer = match_within_groups(
+        census_groups,
+        ber_groups,
+        right_is_candidate=(bers["year_of_construction"] < 2016).to_numpy(
+            dtype="bool", na_value=False
+        ),
     )
-    bers["id"] = bers.groupby(merge_columns).cumcount().apply(lambda x: x + 1)
 
-    before_2016 = census.merge(
-        bers.query("year_of_construction < 2016"),
-        on=["small_area", "period_built", "id"],
-        how="left",
+    matched_bers = (
+        bers.drop(columns=merge_columns + ["id"])
+        .reset_index(drop=True)
+        .reindex(indexer)
     )
-    after_2016 = bers.query("year_of_construction >= 2016")
+    before_2016 = pd.concat(
+        [census.reset_index(drop=True), matched_bers.reset_index(drop=True)], axis=1
+    )
+    after_2016 = bers[(bers["year_of_construction"] >= 2016).fillna(False)]
 
     census_with_bers = pd.concat([before_2016, after_2016]).reset_index(drop=True)
 
-    census_with_bers["cso_ed_id"] = census_with_bers["small_area"].map(
-        small_area_electoral_district_id_map
+    matches = summarise_matches(
+        census_groups, indexer=indexer, levels=levels, on=merge_columns
+    )
+    return census_with_bers, matches
+
+
+def _match_census_with_bers_on_cluster(
+    client: Any, census: pd.DataFrame, bers: pd.DataFrame
+) -> Any:
+    # buildings are only ever matched within a small area so each partition holds
+    # all buildings of its small areas
+    n_partitions = get_n_partitions(client)
+    census_partition_ids = get_partition_ids(census["small_area"], n_partitions)
+    ber_partition_ids = get_partition_ids(bers["small_area"], n_partitions)
+    partitions = range(n_partitions)
+    results = map_partitions(
+        client,
+        _match_census_with_bers,
+        [census[census_partition_ids == i] for i in partitions],
+        [bers[ber_partition_ids == i] for i in partitions],
+    )
+
+    # each partition is its census buildings followed by its bers built since 2016
+    # which are put back in their original order
+    is_after_2016 = (
+        (bers["year_of_construction"] >= 2016).fillna(False).to_numpy(dtype="bool")
+    )
+    census_positions = np.concatenate(
+        [np.flatnonzero(census_partition_ids == i) for i in partitions]
+    )
+    ber_positions = np.concatenate(
+        [np.flatnonzero((ber_partition_ids == i) & is_after_2016) for i in partitions]
+    )
+    n_census_buildings = np.bincount(census_partition_ids, minlength=n_partitions)
+    before_2016 = pd.concat(
+        [cwb.iloc[:n] for (cwb, _), n in zip(results, n_census_buildings)]
+    )
+    after_2016 = pd.concat(
+        [cwb.iloc[n:] for (cwb, _), n in zip(results, n_census_buildings)]
+    )
+    census_with_bers = pd.concat(
+        [
+            before_2016.iloc[np.argsort(census_positions)],
+            after_2016.iloc[np.argsort(ber_positions)],
+        ]
+    ).reset_index(drop=True)
+
+    matches = (
+        pd.concat([m for _, m in results])
+        .sort_values(["small_area", "period_built"])
+        .reset_index(drop=True)
     )
+    return census_with_bers, matches
 
-    census_with_bers.to_parquet(product)
 
+def fill_census_with_bers(
+    product: Any,
+    upstream: Any,
+    incremental: bool,
+    snapshot_dirpath: str,
+    backend: str,
+    n_workers: int,
+    memory_limit: str,
+) -> None:
+    census = pd.read_parquet(upstream["extract_dublin_census_buildings"])
+    bers = pd.read_parquet(upstream["extract_buildings_meeting_conditions"]["data"])
+    small_area_keys = pd.read_parquet(upstream["create_small_area_keys"])
 
-def _get_mode_or_first_occurence(srs: pd.Series) -> str:
-    m = pd.Series.mode(srs)
-    return m.values[0] if not m.empty else np.nan
+    merge_columns = ["small_area", "period_built"]
 
+    census["small_area"] = _encode_small_areas(census["small_area"], small_area_keys)
+    bers["small_area"] = _encode_small_areas(bers["small_area"], small_area_keys)
+    bers["period_built"] = _get_period_built(bers["year_of_construction"])
 
-def _get_aggregation_operations(df):
-    numeric_operations = {c: "median" for c in df.select_dtypes("number").columns}
-    categorical_operations = {
-        c: _get_mode_or_first_occurence
-        for c in set(
-            df.select_dtypes("object").columns.tolist()
-            + df.select_dtypes("string").columns.tolist()
-            + df.select_dtypes("category").columns.tolist()
-        )
+    snapshot_dirpath = Path(snapshot_dirpath)
+    snapshot_dirpath.mkdir(parents=True, exist_ok=True)
+    snapshots = {
+        "census": snapshot_dirpath / "census_row_hashes.parquet",
+        "bers": snapshot_dirpath / "ber_row_hashes.parquet",
+        "data": snapshot_dirpath / "census_with_bers.parquet",
+        "matches": snapshot_dirpath / "census_with_bers_matches.parquet",
     }
-    return {**numeric_operations, **categorical_operations}
+    census_hashes = hash_grouped_rows(census, on=merge_columns)
+    ber_hashes = hash_grouped_rows(bers, on=merge_columns)
+    version = get_version(census_hashes, ber_hashes)
 
+    with start_client(
+        backend, n_workers=n_workers, memory_limit=memory_limit
+    ) as client:
+        if client is None:
+            match_census_with_bers = _match_census_with_bers
+        else:
+            match_census_with_bers = partial(_match_census_with_bers_on_cluster, client)
 
-def create_archetypes(product: Any, upstream: Any) -> None:
-    buildings = pd.read_parquet(upstream["fill_census_with_bers"])
+        if incremental and all(f.exists() for f in snapshots.values()):
+            previous_version = read_versions(snapshots["data"]).get("version")
+            changes = pd.concat(
+                [
+                    get_changed_groups(
+                        pd.read_parquet(snapshots["census"]),
+                        census_hashes,
+                        on=merge_columns,
+                    ),
+                    get_changed_groups(
+                        pd.read_parquet(snapshots["bers"]), ber_hashes, on=merge_columns
+                    ),
+                ]
+            ).drop_duplicates(ignore_index=True)
+            changed_census_with_bers, changed_matches = match_census_with_bers(
+                census[is_in_groups(census, changes, on=merge_columns)].copy(),
+                bers[is_in_groups(bers, changes, on=merge_columns)].copy(),
+            )
+            census_with_bers = patch_groups(
+                pd.read_parquet(snapshots["data"]),
+                changed_census_with_bers,
+                groups=changes,
+                on=merge_columns,
+            )
+            matches = patch_groups(
+                pd.read_parquet(snapshots["matches"]),
+                changed_matches,
+                groups=changes,
+                on=merge_columns,
+            )
+        else:
+            previous_version = None
+            census_with_bers, matches = match_census_with_bers(census, bers)
+            changes = (
+                census_with_bers[merge_columns]
+                .dropna()
+                .drop_duplicates()
+                .astype(str)
+                .reset_index(drop=True)
+            )
+
+    write_versioned_parquet(census_with_bers, snapshots["data"], version=version)
+    matches.to_parquet(snapshots["matches"])
+    census_hashes.to_parquet(snapshots["census"])
+    ber_hashes.to_parquet(snapshots["bers"])
+
+    census_with_bers["cso_ed_id"] = _get_electoral_districts(
+        census_with_bers["small_area"], small_area_keys
+    )
 
+    census_with_bers.to_parquet(product["data"])
+    # uncompressed so that downstream tasks can memory-map it rather than decode it
+    feather.write_feather(
+        census_with_bers, product["arrow"], compression="uncompressed"
+    )
+    matches.to_parquet(product["matches"])
+    # the changes since the previous version, or every group if there was none
+    write_versioned_parquet(
+        changes,
+        product["changes"],
+        previous_version=previous_version,
+        version=version,
+    )
+
+
+def _read_census_with_bers(
+    filepaths: Any, memory_map: bool, is_known: Optional[bool] = None
+) -> pd.DataFrame:
+    # a memory-mapped arrow file is shared via the page cache by every task reading
+    # it & only the rows which a task selects are converted to pandas
+    if memory_map:
+        table = feather.read_table(filepaths["arrow"], memory_map=True)
+        if is_known is not None:
+            is_unknown = pc.is_null(table.column("countyname"))
+            table = table.filter(pc.invert(is_unknown) if is_known else is_unknown)
+        return table.to_pandas()
+    else:
+        buildings = pd.read_parquet(filepaths["data"])
+        if is_known is not None:
+            buildings = buildings[buildings["countyname"].notnull() == is_known]
+        return buildings
+
+
+def _select_archetypes_of_sufficient_size(
+    archetype: List[str], agg_buildings: pd.DataFrame, min_sample_size: int
+) -> pd.DataFrame:
+    archetype_name = "_".join(archetype)
+    sample_size_column = f"sample_size__{archetype_name}"
+    agg_buildings_of_sufficient_size = (
+        agg_buildings.rename(columns={"sample_size": sample_size_column})
+        .query(f"`{sample_size_column}` > @min_sample_size")
+        .reset_index(drop=True)
+    )
+    agg_buildings_of_sufficient_size["archetype"] = archetype_name
+    return agg_buildings_of_sufficient_size
+
+
+def _read_parquet_in_chunks(
+    filepath: PathLike, chunksize: int
+) -> Iterator[pd.DataFrame]:
+    for batch in pq.ParquetFile(filepath).iter_batches(batch_size=chunksize):
+        yield pa.Table.from_batches([batch]).to_pandas()
+
+
+def _read_arrow_in_chunks(filepath: PathLike, chunksize: int) -> Iterator[pd.DataFrame]:
+    # batches are zero-copy slices of the memory-mapped file
+    table = feather.read_table(filepath, memory_map=True)
+    for batch in table.to_batches(max_chunksize=chunksize):
+        yield pa.Table.from_batches([batch]).to_pandas()
+
+
+def _count_archetype_values(
+    buildings: pd.DataFrame, archetype_columns: List[List[str]]
+) -> List[Tuple[List[str], Dict[str, Any]]]:
+    return list(count_archetype_values(buildings, archetype_columns))
+
+
+def _rollup_archetypes_on_cluster(
+    client: Any,
+    buildings: pd.DataFrame,
+    archetype_columns: List[List[str]],
+    bootstrap: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[List[str], pd.DataFrame]]:
+    # value counts are exact so merging those of each partition gives the same
+    # archetypes as counting all buildings at once
+    value_counts = map_partitions(
+        client,
+        _count_archetype_values,
+        split_rows(buildings, get_n_partitions(client)),
+        archetype_columns=archetype_columns,
+    )
+    for i, archetype in enumerate(archetype_columns):
+        yield archetype, aggregate_archetype_values(
+            merge_archetype_values([counts[i][1] for counts in value_counts]),
+            bootstrap=bootstrap,
+        )
+
+
+def create_archetypes(
+    product: Any,
+    upstream: Any,
+    incremental: bool,
+    snapshot_dirpath: str,
+    relative_error: Optional[float],
+    chunksize: int,
+    memory_map: bool,
+    backend: str,
+    n_workers: int,
+    memory_limit: str,
+    bootstrap: Optional[Dict[str, Any]],
+) -> None:
     dirpath = Path(product)
     dirpath.mkdir(exist_ok=True)
 
     min_sample_size = 30
-    archetype_columns = [
-        ["small_area", "period_built"],
-        ["cso_ed_id", "period_built"],
-        ["countyname", "period_built"],
-        ["period_built"],
+    archetype_columns = ARCHETYPE_COLUMNS
+
+    # only the finest level is patched, coarser levels span too many changes
+    finest_archetype = archetype_columns[0]
+    snapshot_dirpath = Path(snapshot_dirpath)
+    snapshot_dirpath.mkdir(parents=True, exist_ok=True)
+    snapshot_name = "_".join(finest_archetype)
+    if bootstrap is not None:
+        # intervals drawn with other bootstrap settings are never patched into these
+        options = json.dumps(bootstrap, sort_keys=True)
+        snapshot_name += "-" + hashlib.md5(options.encode()).hexdigest()[:8]
+    snapshot_filepath = snapshot_dirpath / f"{snapshot_name}.parquet"
+    if bootstrap is not None:
+        bootstrap = {**bootstrap, "min_sample_size": min_sample_size}
+    # the changes are only patched into archetypes of the version they change, so
+    # if fill_census_with_bers has been rebuilt since the archetypes were, or has
+    # no previous version, the archetypes are rebuilt
+    fill_versions = read_versions(upstream["fill_census_with_bers"]["changes"])
+    is_patchable = (
+        incremental
+        and snapshot_filepath.exists()
+        and fill_versions.get("previous_version") is not None
+        and read_versions(snapshot_filepath).get("fill_version")
+        == fill_versions["previous_version"]
+    )
+    with start_client(
+        backend, n_workers=n_workers, memory_limit=memory_limit
+    ) as client:
+        if client is None:
+            rollup = partial(rollup_archetypes, bootstrap=bootstrap)
+        else:
+            rollup = partial(_rollup_archetypes_on_cluster, client, bootstrap=bootstrap)
+
+        # sketched archetypes are streamed through this process to bound its memory
+        if relative_error is not None:
+            # sketched medians would otherwise be patched into exact ones next time
+            snapshot_filepath.unlink(missing_ok=True)
+            if memory_map:
+                chunks = _read_arrow_in_chunks(
+                    upstream["fill_census_with_bers"]["arrow"], chunksize=chunksize
+                )
+            else:
+                chunks = _read_parquet_in_chunks(
+                    upstream["fill_census_with_bers"]["data"], chunksize=chunksize
+                )
+            archetypes = [
+                (
+                    archetype,
+                    _select_archetypes_of_sufficient_size(
+                        archetype, agg_buildings, min_sample_size
+                    ),
+                )
+                for archetype, agg_buildings in stream_archetypes(
+                    chunks,
+                    archetype_columns,
+                    relative_error=relative_error,
+                    bootstrap=bootstrap,
+                )
+            ]
+        elif is_patchable:
+            buildings = _read_census_with_bers(
+                upstream["fill_census_with_bers"], memory_map=memory_map
+            )
+            changes = pd.read_parquet(upstream["fill_census_with_bers"]["changes"])
+            changed_buildings = buildings[
+                is_in_groups(buildings, changes, on=finest_archetype)
+            ]
+            [(_, changed_agg_buildings)] = rollup(changed_buildings, [finest_archetype])
+            finest_agg_buildings = (
+                patch_groups(
+                    pd.read_parquet(snapshot_filepath),
+                    _select_archetypes_of_sufficient_size(
+                        finest_archetype, changed_agg_buildings, min_sample_size
+                    ),
+                    groups=changes,
+                    on=finest_archetype,
+                )
+                .sort_values(finest_archetype, kind="stable")
+                .reset_index(drop=True)
+            )
+            archetypes = [(finest_archetype, finest_agg_buildings)] + [
+                (
+                    archetype,
+                    _select_archetypes_of_sufficient_size(
+                        archetype, agg_buildings, min_sample_size
+                    ),
+                )
+                for archetype, agg_buildings in rollup(buildings, archetype_columns[1:])
+            ]
+        else:
+            buildings = _read_census_with_bers(
+                upstream["fill_census_with_bers"], memory_map=memory_map
+            )
+            archetypes = [
+                (
+                    archetype,
+                    _select_archetypes_of_sufficient_size(
+                        archetype, agg_buildings, min_sample_size
+                    ),
+                )
+                for archetype, agg_buildings in rollup(buildings, archetype_columns)
+            ]
+
+    for archetype, agg_buildings_of_sufficient_size in archetypes:
+        if archetype == finest_archetype and relative_error is None:
+            write_versioned_parquet(
+                agg_buildings_of_sufficient_size,
+                snapshot_filepath,
+                fill_version=fill_versions.get("version"),
+            )
+        agg_buildings_of_sufficient_size.to_csv(
+            dirpath / f"{'_'.join(archetype)}.csv", index=False
+        )
+
+
+def _fill_with_archetypes(
+    unknown_buildings: pd.DataFrame, archetypes: List[Any]
+) -> pd.DataFrame:
+    archetype_index = build_archetype_index(
+        [(c, table.dropna(subset=["countyname"])) for c, table in archetypes]
+    )
+    positions = find_archetypes(archetype_index, buildings=unknown_buildings)
+    is_resolved = positions != -1
+    matched_archetypes = archetype_index["archetypes"].take(positions[is_resolved])
+    return (
+        unknown_buildings[is_resolved]
+        .reset_index(drop=True)
+        .combine_first(matched_archetypes.reset_index(drop=True))
+    )
+
+
+def fill_unknown_buildings_with_archetypes(
+    product: Any,
+    upstream: Any,
+    memory_map: bool,
+    backend: str,
+    n_workers: int,
+    memory_limit: str,
+) -> None:
+    unknown_buildings = _read_census_with_bers(
+        upstream["fill_census_with_bers"], memory_map=memory_map, is_known=False
+    ).reset_index(drop=True)
+    input_dirpath = Path(upstream["create_archetypes"])
+
+    archetypes = [
+        (
+            archetype_columns,
+            pd.read_csv(
+                input_dirpath / ("_".join(archetype_columns) + ".csv"),
+                dtype={c: str for c in archetype_columns},
+            ),
+        )
+        for archetype_columns in ARCHETYPE_COLUMNS
+    ]
+    with start_client(
+        backend, n_workers=n_workers, memory_limit=memory_limit
+    ) as client:
+        if client is None:
+            unknown_buildings_filled_with_archetypes = _fill_with_archetypes(
+                unknown_buildings, archetypes=archetypes
+            )
+        else:
+            unknown_buildings_filled_with_archetypes = pd.concat(
+                map_partitions(
+                    client,
+                    _fill_with_archetypes,
+                    split_rows(unknown_buildings, get_n_partitions(client)),
+                    archetypes=archetypes,
+                ),
+                ignore_index=True,
+            )
+    unknown_buildings_filled_with_archetypes.to_parquet(product)
+
+
+def _get_neighbour_features(
+    buildings: pd.DataFrame, small_area_points: pd.DataFrame
+) -> np.ndarray:
+    # a building is located at a point within its small area & periods built are
+    # ordered so that neighbouring periods are nearer than distant ones
+    points = small_area_points.reindex(buildings["small_area"].to_numpy())
+    period_built_codes = pd.Categorical(
+        buildings["period_built"], categories=PERIODS_BUILT
+    ).codes
+    return np.column_stack(
+        [
+            points["x"].to_numpy(),
+            points["y"].to_numpy(),
+            np.where(period_built_codes == -1, np.nan, period_built_codes),
+        ]
+    )
+
+
+def fill_unknown_buildings_with_neighbours(
+    product: Any,
+    upstream: Any,
+    k: int,
+    batch_size: int,
+    memory_map: bool,
+    backend: str,
+    n_workers: int,
+    memory_limit: str,
+) -> None:
+    buildings = _read_census_with_bers(
+        upstream["fill_census_with_bers"], memory_map=memory_map
+    )
+    small_area_boundaries = gpd.read_file(
+        str(upstream["download_dublin_small_area_boundaries"])
+    )
+    points = small_area_boundaries.geometry.representative_point()
+    small_area_points = pd.DataFrame(
+        {"x": points.x.to_numpy(), "y": points.y.to_numpy()},
+        index=small_area_boundaries["small_area"].to_numpy(),
+    )
+
+    # like the archetypes, buildings which can't be located are left unfilled
+    features = _get_neighbour_features(buildings, small_area_points)
+    is_located = ~np.isnan(features).any(axis=1)
+    is_known = buildings["countyname"].notnull().to_numpy()
+    observed_buildings = buildings[is_known & is_located]
+    unknown_buildings = buildings[~is_known].reset_index(drop=True)
+    if len(observed_buildings) == 0 or not is_located[~is_known].any():
+        unknown_buildings.to_parquet(product)
+        return
+    observed_features, unknown_features = standardise_features(
+        features[is_known & is_located], features[~is_known & is_located]
+    )
+
+    columns = [
+        c
+        for c in unknown_buildings.columns[unknown_buildings.isnull().any()]
+        if c not in NEIGHBOUR_KEY_COLUMNS
+    ]
+    values = encode_neighbour_values(observed_buildings, columns=columns)
+    tree = cKDTree(observed_features)
+    k = min(k, len(observed_buildings))
+    batches = [
+        unknown_features[start : start + batch_size]
+        for start in range(0, len(unknown_features), batch_size)
     ]
-    for archetype in archetype_columns:
-        archetype_name = "_".join(archetype)
-        sample_size_column = f"sample_size__{archetype_name}"
-        archetype_group_sizes = (
-            buildings.groupby(archetype).size().rename(sample_size_column)
+    with start_client(
+        backend, n_workers=n_workers, memory_limit=memory_limit
+    ) as client:
+        if client is None:
+            imputed = [
+                impute_from_neighbours(batch, tree=tree, values=values, k=k, workers=-1)
+                for batch in batches
+            ]
+        else:
+            imputed = map_partitions(
+                client, impute_from_neighbours, batches, tree=tree, values=values, k=k
+            )
+    imputed_buildings = pd.concat(imputed, ignore_index=True)
+    imputed_buildings.index = np.flatnonzero(is_located[~is_known])
+    unknown_buildings.combine_first(imputed_buildings).to_parquet(product)
+
+
+def _save_as_partitioned_parquet(
+    df: pd.DataFrame,
+    dirpath: PathLike,
+    partition_on: str,
+    sort_by: str,
+    row_group_size: int,
+) -> None:
+    # sorting clusters each small area into few row groups so that their min/max
+    # statistics let readers skip the rest
+    object_columns = df.select_dtypes("object").columns
+    table = pa.Table.from_pandas(
+        df.sort_values(sort_by, kind="stable").astype(
+            {c: "category" for c in object_columns}
+        ),
+        preserve_index=False,
+    )
+    ds.write_dataset(
+        table,
+        dirpath,
+        format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([table.schema.field(partition_on)]), flavor="hive"
+        ),
+        max_rows_per_group=row_group_size,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def _save_estimated_buildings(
+    product: Any,
+    known_buildings: pd.DataFrame,
+    unknown_buildings: pd.DataFrame,
+    small_area_boundaries: gpd.GeoDataFrame,
+    row_group_size: int,
+) -> None:
+    estimated_buildings = pd.concat([known_buildings, unknown_buildings])
+    estimated_buildings.to_csv(product["csv"], index=False)
+
+    local_authority_map = small_area_boundaries.set_index("small_area")[
+        "local_authority"
+    ]
+    estimated_buildings["local_authority"] = estimated_buildings["small_area"].map(
+        local_authority_map
+    )
+    _save_as_partitioned_parquet(
+        estimated_buildings,
+        dirpath=product["parquet"],
+        partition_on="local_authority",
+        sort_by="small_area",
+        row_group_size=row_group_size,
+    )
+
+
+def combine_known_and_archetyped_buildings(
+    product: Any, upstream: Any, row_group_size: int, memory_map: bool
+) -> None:
+    known_buildings = _read_census_with_bers(
+        upstream["fill_census_with_bers"], memory_map=memory_map, is_known=True
+    )
+    unknown_buildings = pd.read_parquet(
+        upstream["fill_unknown_buildings_with_archetypes"]
+    )
+    small_area_boundaries = gpd.read_file(
+        str(upstream["download_dublin_small_area_boundaries"]), ignore_geometry=True
+    )
+    _save_estimated_buildings(
+        product,
+        known_buildings=known_buildings,
+        unknown_buildings=unknown_buildings,
+        small_area_boundaries=small_area_boundaries,
+        row_group_size=row_group_size,
+    )
+
+
+def combine_known_and_neighbour_buildings(
+    product: Any, upstream: Any, row_group_size: int, memory_map: bool
+) -> None:
+    # a separate task so the neighbours are only found if their estimate is built
+    known_buildings = _read_census_with_bers(
+        upstream["fill_census_with_bers"], memory_map=memory_map, is_known=True
+    )
+    unknown_buildings = pd.read_parquet(
+        upstream["fill_unknown_buildings_with_neighbours"]
+    )
+    small_area_boundaries = gpd.read_file(
+        str(upstream["download_dublin_small_area_boundaries"]), ignore_geometry=True
+    )
+    _save_estimated_buildings(
+        product,
+        known_buildings=known_buildings,
+        unknown_buildings=unknown_buildings,
+        small_area_boundaries=small_area_boundaries,
+        row_group_size=row_group_size,
+    )
+
+
+def _get_county_codes(small_areas: Any) -> Any:
+    # small area ids start with the code of their county (e.g. 268 is Dublin City)
+    # so a shard of small areas holds every building of every small area within it
+    return pc.utf8_slice_codeunits(
+        pc.cast(small_areas, pa.string()), start=0, stop=COUNTY_CODE_LENGTH
+    )
+
+
+def _get_county_partitioning() -> Any:
+    # hive partitioning would otherwise infer codes like 017 as integers
+    return ds.partitioning(pa.schema([("county", pa.string())]), flavor="hive")
+
+
+def _add_county_codes(batches: Iterator[pa.RecordBatch]) -> Iterator[pa.RecordBatch]:
+    for batch in batches:
+        county_codes = _get_county_codes(batch.column("small_area"))
+        yield pa.RecordBatch.from_arrays(
+            batch.columns + [county_codes],
+            names=batch.schema.names + ["county"],
+        )
+
+
+def _write_shards(
+    batches: Iterator[pa.RecordBatch], schema: pa.Schema, dirpath: Path
+) -> None:
+    ds.write_dataset(
+        _add_county_codes(batches),
+        dirpath,
+        schema=schema.append(pa.field("county", pa.string())),
+        format="parquet",
+        partitioning=_get_county_partitioning(),
+        existing_data_behavior="delete_matching",
+    )
+
+
+def shard_buildings_by_county(
+    product: Any,
+    upstream: Any,
+    conditions: List[Any],
+    columns: List[str],
+    chunksize: int,
+    profile_rejections: bool,
+) -> None:
+    buildings = ds.dataset(
+        upstream["save_selected_columns_as_parquet"]["data"],
+        format="parquet",
+        partitioning="hive",
+    )
+    filter_expression = compile_conditions(conditions, schema=buildings.schema)
+    scanner = buildings.scanner(
+        columns=get_published_columns(columns) + [ROW_NUMBER_COLUMN],
+        filter=filter_expression,
+        batch_size=chunksize,
+    )
+    _write_shards(
+        scanner.to_batches(), schema=scanner.projected_schema, dirpath=product["bers"]
+    )
+
+    _write_rejections(
+        product["rejections"],
+        buildings=buildings,
+        conditions=conditions,
+        profile_rejections=profile_rejections,
+    )
+
+    census_chunks = pd.read_csv(
+        upstream["download_census_building_ages"],
+        dtype={"small_area": str},
+        chunksize=chunksize,
+    )
+    census_schema = pa.schema(
+        [("small_area", pa.string()), ("period_built", pa.string())]
+    )
+    _write_shards(
+        (
+            pa.RecordBatch.from_pandas(
+                chunk, schema=census_schema, preserve_index=False
+            )
+            for chunk in census_chunks
+        ),
+        schema=census_schema,
+        dirpath=product["census"],
+    )
+
+
+def _read_shard(dirpath: PathLike, county: str) -> pd.DataFrame:
+    shards = ds.dataset(
+        dirpath, format="parquet", partitioning=_get_county_partitioning()
+    )
+    return (
+        shards.to_table(filter=ds.field("county") == county)
+        .drop(["county"])
+        .to_pandas(types_mapper=get_pandas_dtype)
+    )
+
+
+def _fill_county_census_with_bers(
+    county: str,
+    shard_dirpaths: Dict[str, Path],
+    output_dirpath: Path,
+    small_area_electoral_district_id_map: Dict[str, str],
+    county_archetype_columns: List[List[str]],
+    national_archetype_columns: List[List[str]],
+    min_sample_size: int,
+    relative_error: Optional[float],
+) -> Any:
+    census = _read_shard(shard_dirpaths["census"], county=county)
+    bers = (
+        _read_shard(shard_dirpaths["bers"], county=county)
+        .sort_values(ROW_NUMBER_COLUMN, kind="stable", ignore_index=True)
+        .drop(columns=ROW_NUMBER_COLUMN)
+    )
+    bers["period_built"] = _get_period_built(bers["year_of_construction"])
+
+    census_with_bers, _ = _match_census_with_bers(census, bers)
+    census_with_bers["cso_ed_id"] = census_with_bers["small_area"].map(
+        small_area_electoral_district_id_map
+    )
+    census_with_bers = sort_categories(census_with_bers)
+    county_dirpath = output_dirpath / f"county={county}"
+    county_dirpath.mkdir(parents=True, exist_ok=True)
+    census_with_bers.to_parquet(county_dirpath / "part-0.parquet")
+
+    county_archetypes = [
+        (
+            archetype,
+            _select_archetypes_of_sufficient_size(
+                archetype, agg_buildings, min_sample_size
+            ),
         )
-        agg_columns = set(buildings.columns).difference(set(archetype))
-        aggregation_operations = _get_aggregation_operations(buildings[agg_columns])
-        agg_buildings = buildings.groupby(archetype).agg(aggregation_operations)
-        agg_buildings_of_sufficient_size = (
-            agg_buildings.join(archetype_group_sizes)
-            .query(f"`{sample_size_column}` > @min_sample_size")
-            .reset_index()
+        for archetype, agg_buildings in rollup_archetypes(
+            census_with_bers, county_archetype_columns, relative_error=relative_error
         )
-        agg_buildings_of_sufficient_size["archetype"] = archetype_name
-        agg_buildings_of_sufficient_size.to_csv(
-            dirpath / f"{archetype_name}.csv", index=False
+    ]
+    national_value_counts = list(
+        count_archetype_values(
+            census_with_bers,
+            national_archetype_columns,
+            relative_error=relative_error,
         )
+    )
+    return county_archetypes, national_value_counts
 
 
-def fill_unknown_buildings_with_archetypes(product: Any, upstream: Any) -> None:
-    buildings = pd.read_parquet(upstream["fill_census_with_bers"])
-    input_dirpath = Path(upstream["create_archetypes"])
-    output_dirpath = Path(product)
-    output_dirpath.mkdir(exist_ok=True)
+def _fill_county_unknown_buildings(
+    county: str,
+    census_with_bers_dirpath: Path,
+    output_dirpath: Path,
+    archetypes: List[Any],
+) -> None:
+    buildings = pd.read_parquet(
+        census_with_bers_dirpath / f"county={county}" / "part-0.parquet"
+    )
+    is_unknown = buildings["countyname"].isnull()
+    unknown_buildings = buildings[is_unknown].reset_index(drop=True)
+    estimated_buildings = pd.concat(
+        [
+            buildings[~is_unknown],
+            _fill_with_archetypes(unknown_buildings, archetypes=archetypes),
+        ],
+        ignore_index=True,
+    )
+    county_dirpath = output_dirpath / f"county={county}"
+    county_dirpath.mkdir(parents=True, exist_ok=True)
+    estimated_buildings.to_parquet(county_dirpath / "part-0.parquet")
+
+
+def estimate_stock_by_county(
+    product: Any, upstream: Any, n_workers: int, relative_error: Optional[float]
+) -> None:
+    shard_dirpaths = {
+        "bers": Path(upstream["shard_buildings_by_county"]["bers"]),
+        "census": Path(upstream["shard_buildings_by_county"]["census"]),
+    }
+    with open(upstream["download_small_area_electoral_district_id_map"], "r") as f:
+        small_area_electoral_district_id_map = json.load(f)
+    census_with_bers_dirpath = Path(product["census_with_bers"])
+    archetypes_dirpath = Path(product["archetypes"])
+    estimated_buildings_dirpath = Path(product["data"])
+    for dirpath in [
+        census_with_bers_dirpath,
+        archetypes_dirpath,
+        estimated_buildings_dirpath,
+    ]:
+        if dirpath.exists():
+            rmtree(dirpath)
+        dirpath.mkdir(parents=True)
 
-    unknown_buildings = buildings[buildings["countyname"].isnull()]
-    archetype_groups = [
+    counties = sorted(
+        p.name.split("=", 1)[1] for p in shard_dirpaths["census"].glob("county=*")
+    )
+
+    # small areas & electoral districts never cross a county so only the coarser
+    # levels need the value counts of every county
+    min_sample_size = 30
+    county_archetype_columns = [
         ["small_area", "period_built"],
         ["cso_ed_id", "period_built"],
+    ]
+    national_archetype_columns = [
         ["countyname", "period_built"],
         ["period_built"],
     ]
-    for archetype_columns in archetype_groups:
-        unknown_buildings = unknown_buildings[unknown_buildings["countyname"].isnull()]
-        filename = "_".join(archetype_columns) + ".csv"
-        archetypes = pd.read_csv(input_dirpath / filename)
-        unknown_buildings = (
-            unknown_buildings.set_index(archetype_columns)
-            .combine_first(archetypes.set_index(archetype_columns))
-            .reset_index()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        county_results = list(
+            executor.map(
+                partial(
+                    _fill_county_census_with_bers,
+                    shard_dirpaths=shard_dirpaths,
+                    output_dirpath=census_with_bers_dirpath,
+                    small_area_electoral_district_id_map=small_area_electoral_district_id_map,
+                    county_archetype_columns=county_archetype_columns,
+                    national_archetype_columns=national_archetype_columns,
+                    min_sample_size=min_sample_size,
+                    relative_error=relative_error,
+                ),
+                counties,
+            )
         )
-        unknown_buildings.dropna(subset=["countyname"]).to_csv(output_dirpath / filename)
 
+        archetypes = [
+            (
+                archetype,
+                pd.concat(
+                    [
+                        county_archetypes[i][1]
+                        for county_archetypes, _ in county_results
+                    ],
+                    ignore_index=True,
+                ),
+            )
+            for i, archetype in enumerate(county_archetype_columns)
+        ] + [
+            (
+                archetype,
+                _select_archetypes_of_sufficient_size(
+                    archetype,
+                    aggregate_archetype_values(
+                        merge_archetype_values(
+                            [value_counts[i][1] for _, value_counts in county_results]
+                        )
+                    ),
+                    min_sample_size,
+                ),
+            )
+            for i, archetype in enumerate(national_archetype_columns)
+        ]
+        for archetype, table in archetypes:
+            table.to_csv(archetypes_dirpath / f"{'_'.join(archetype)}.csv", index=False)
 
-def combine_known_and_archetyped_buildings(product: Any, upstream: Any) -> None:
-    buildings = pd.read_parquet(upstream["fill_census_with_bers"])
-    known_buildings = buildings[buildings["countyname"].notnull()]
-    unknown_buildings = [
-        pd.read_csv(f)
-        for f in Path(upstream["fill_unknown_buildings_with_archetypes"]).iterdir()
-    ]
-    estimated_buildings = pd.concat([known_buildings] + unknown_buildings)
-    estimated_buildings.to_csv(product, index=False)
+        list(
+            executor.map(
+                partial(
+                    _fill_county_unknown_buildings,
+                    census_with_bers_dirpath=census_with_bers_dirpath,
+                    output_dirpath=estimated_buildings_dirpath,
+                    archetypes=archetypes,
+                ),
+                counties,
+            )
+        )
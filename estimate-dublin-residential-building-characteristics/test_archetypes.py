@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from archetypes import build_archetype_index
+from archetypes import find_archetypes
+from archetypes import rollup_archetypes
+from archetypes import stream_archetypes
+
+ARCHETYPE_COLUMNS = [
+    ["small_area", "period_built"],
+    ["cso_ed_id", "period_built"],
+    ["period_built"],
+]
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(42)
+    n_rows = 20000
+    small_areas = rng.integers(0, 200, size=n_rows)
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in small_areas],
+            "cso_ed_id": [f"{i // 15:05d}" for i in small_areas],
+            "period_built": rng.choice(["PRE19", "71_80", "01_10"], size=n_rows),
+            # few values so that many groups have tied modes, categories are in
+            # neither sorted nor first appearance order
+            "main_sh_boiler_fuel": pd.Categorical(
+                rng.choice(["Mains Gas", "Heating Oil", "Electricity"], size=n_rows),
+                categories=["Heating Oil", "Mains Gas", "Electricity", "Wood"],
+            ),
+            "dwelling_type": rng.choice(["Apartment", "House", None], size=n_rows),
+            "energy_value": rng.gamma(2, 100, size=n_rows).astype("float32"),
+        }
+    )
+
+
+def _get_mode_or_first_occurence(srs):
+    m = pd.Series.mode(srs)
+    return m.values[0] if not m.empty else np.nan
+
+
+def _create_archetypes_baseline(buildings, archetype):
+    # the aggregation of create_archetypes before all levels were rolled up from one
+    # set of value counts, less its sample size filter & with agg_columns as a list
+    # as pandas no longer indexes by a set
+    agg_columns = set(buildings.columns).difference(set(archetype))
+    numeric_operations = {
+        c: "median" for c in buildings[list(agg_columns)].select_dtypes("number")
+    }
+    categorical_operations = {
+        c: _get_mode_or_first_occurence
+        for c in buildings[list(agg_columns)].select_dtypes(
+            ["object", "string", "category"]
+        )
+    }
+    aggregation_operations = {**numeric_operations, **categorical_operations}
+    return (
+        buildings.groupby(archetype)
+        .agg(aggregation_operations)
+        .join(buildings.groupby(archetype).size().rename("sample_size"))
+        .reset_index()
+    )
+
+
+def _get_modes(archetypes):
+    return {
+        tuple(archetype): table[["main_sh_boiler_fuel", "dwelling_type"]]
+        for archetype, table in archetypes
+    }
+
+
+def test_rollup_archetypes_aggregates_as_the_baseline(buildings):
+    for archetype, table in rollup_archetypes(buildings, ARCHETYPE_COLUMNS):
+        expected = _create_archetypes_baseline(buildings, archetype)
+        expected = expected.astype({"main_sh_boiler_fuel": "object"}).sort_values(
+            archetype, ignore_index=True
+        )
+
+        table = table[expected.columns].sort_values(archetype, ignore_index=True)
+
+        pd.testing.assert_frame_equal(table, expected)
+
+
+def test_stream_archetypes_finds_the_same_modes_as_rollup_archetypes(buildings):
+    expected = _get_modes(rollup_archetypes(buildings, ARCHETYPE_COLUMNS))
+
+    chunks = [buildings.iloc[i : i + 1000] for i in range(0, len(buildings), 1000)]
+    modes = _get_modes(
+        stream_archetypes(chunks, ARCHETYPE_COLUMNS, relative_error=0.01)
+    )
+
+    for archetype, expected_modes in expected.items():
+        pd.testing.assert_frame_equal(modes[archetype], expected_modes)
+
+
+def test_stream_archetypes_finds_the_same_modes_from_parquet_chunks(
+    buildings, tmp_path
+):
+    # each row group stores its own dictionary of only the categories it holds
+    filepath = tmp_path / "buildings.parquet"
+    buildings.sample(frac=1, random_state=0).to_parquet(filepath, row_group_size=999)
+    expected = _get_modes(
+        rollup_archetypes(pd.read_parquet(filepath), ARCHETYPE_COLUMNS)
+    )
+
+    chunks = (
+        pa.Table.from_batches([batch]).to_pandas()
+        for batch in pq.ParquetFile(filepath).iter_batches(batch_size=1000)
+    )
+    modes = _get_modes(
+        stream_archetypes(chunks, ARCHETYPE_COLUMNS, relative_error=0.01)
+    )
+
+    for archetype, expected_modes in expected.items():
+        pd.testing.assert_frame_equal(modes[archetype], expected_modes)
+
+
+def test_build_archetype_index_without_any_archetypes(buildings):
+    archetypes = list(rollup_archetypes(buildings, ARCHETYPE_COLUMNS))
+    expected_columns = build_archetype_index(archetypes)["archetypes"].columns
+
+    index = build_archetype_index([(c, table.iloc[:0]) for c, table in archetypes])
+
+    assert len(index["archetypes"]) == 0
+    assert set(index["archetypes"].columns) == set(expected_columns)
+    positions = find_archetypes(index, buildings=buildings)
+    assert (positions == -1).all()
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from archetypes import count_archetype_values
+import bootstrap
+from bootstrap import bootstrap_archetype_values
+
+ARCHETYPE = ["small_area", "period_built"]
+FUELS = ["Heating Oil", "Mains Gas", "Electricity"]
+OPTIONS = dict(
+    n_resamples=30,
+    confidence_level=0.9,
+    memory_budget=400000,
+    random_state=42,
+    min_sample_size=5,
+)
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(42)
+    n_rows = 6000
+    # groups range from too small to resample to too big to resample in one block
+    small_areas = np.minimum(rng.geometric(0.03, size=n_rows), 60)
+    energy_values = rng.gamma(2, 100, size=n_rows)
+    energy_values[rng.random(n_rows) < 0.2] = np.nan
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in small_areas],
+            "period_built": rng.choice(["PRE19", "71_80", "01_10"], size=n_rows),
+            "main_sh_boiler_fuel": pd.Categorical(
+                rng.choice(FUELS + [None], size=n_rows), categories=FUELS
+            ),
+            "dwelling_type": rng.choice(["Apartment", "House", None], size=n_rows),
+            "energy_value": energy_values,
+        }
+    )
+
+
+@pytest.fixture(params=["searched", "decoded"])
+def codes(request, monkeypatch):
+    if request.param == "decoded":
+        monkeypatch.setattr(bootstrap, "MAX_SEARCHED_CODES", 0)
+    return request.param
+
+
+class _RecordingGenerator:
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.draws = []
+
+    def integers(self, *args, **kwargs):
+        draws = self.rng.integers(*args, **kwargs)
+        self.draws.append(draws.copy())
+        return draws
+
+
+def _get_mode_or_first_occurence(srs):
+    m = pd.Series.mode(srs)
+    return m.values[0] if not m.empty else np.nan
+
+
+def _bootstrap_baseline(buildings, keys, blocks, draws):
+    # resamples buildings one resample at a time with the same draws & aggregates
+    # each as create_archetypes aggregates buildings, a group's values are sorted as
+    # its value counts lay them out with known values in order & then missing values
+    columns = ["main_sh_boiler_fuel", "dwelling_type", "energy_value"]
+    grouped = buildings.groupby(ARCHETYPE)
+    groups = [
+        {
+            c: grouped.get_group(tuple(k))[c].sort_values(ignore_index=True)
+            for c in columns
+        }
+        for k in keys.itertuples(index=False)
+    ]
+    medians = [[] for _ in groups]
+    n_agreeing = {c: np.zeros(len(groups)) for c in columns}
+    for (block_groups, start, stop), positions in zip(blocks, draws):
+        for group, p in zip(np.repeat(block_groups, stop - start), positions):
+            values = groups[group]
+            resample = values["energy_value"].iloc[p]
+            medians[group].append(resample.median())
+            for column in ["main_sh_boiler_fuel", "dwelling_type"]:
+                mode = _get_mode_or_first_occurence(values[column])
+                resampled_mode = _get_mode_or_first_occurence(values[column].iloc[p])
+                n_agreeing[column][group] += mode == resampled_mode
+    intervals = np.array(
+        [
+            np.nanquantile(m, [0.05, 0.5, 0.95])
+            if len(m) and not np.isnan(m).all()
+            else [np.nan] * 3
+            for m in medians
+        ]
+    )
+    return intervals, n_agreeing
+
+
+def test_bootstrap_archetype_values_resamples_as_the_baseline(
+    buildings, codes, monkeypatch
+):
+    ((_, value_counts),) = count_archetype_values(buildings, [ARCHETYPE])
+    rng = _RecordingGenerator(OPTIONS["random_state"])
+    monkeypatch.setattr(bootstrap.np.random, "default_rng", lambda seed: rng)
+    blocks = list(
+        bootstrap._iter_resample_blocks(
+            value_counts["sample_size"],
+            n_resamples=OPTIONS["n_resamples"],
+            memory_budget=OPTIONS["memory_budget"],
+            min_sample_size=OPTIONS["min_sample_size"],
+        )
+    )
+
+    bootstrapped = bootstrap_archetype_values(value_counts, **OPTIONS)
+
+    intervals, n_agreeing = _bootstrap_baseline(
+        buildings, value_counts["keys"], blocks=blocks, draws=rng.draws
+    )
+
+    assert any(stop - start < OPTIONS["n_resamples"] for _, start, stop in blocks)
+    assert any(len(groups) > 1 for groups, _, _ in blocks)
+    for i, name in enumerate(["lower", "median", "upper"]):
+        np.testing.assert_allclose(
+            bootstrapped[f"energy_value__{name}"], intervals[:, i]
+        )
+    is_resampled = value_counts["sample_size"] > OPTIONS["min_sample_size"]
+    for column in ["main_sh_boiler_fuel", "dwelling_type"]:
+        mode_share = bootstrapped[f"{column}__mode_share"]
+        assert np.isnan(mode_share[~is_resampled]).all()
+        np.testing.assert_array_equal(
+            mode_share[is_resampled],
+            n_agreeing[column][is_resampled] / OPTIONS["n_resamples"],
+        )
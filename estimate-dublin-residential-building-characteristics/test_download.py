@@ -0,0 +1,100 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+from threading import Thread
+
+import pytest
+
+from download import fetch_file
+
+CONTENT = bytes(range(256)) * 4096
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if self.server.supports_range and range_header and if_range == ETAG:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:])
+
+    do_POST = do_GET
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["range", "ignores_range"])
+def server(request):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    server.supports_range = request.param
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _get_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/BERPublicsearch.zip"
+
+
+def test_fetch_file_leaves_unchanged_file_untouched(server, tmp_path):
+    filepath = tmp_path / "BERPublicsearch.zip"
+
+    assert fetch_file(_get_url(server), filepath, method="POST")
+    assert filepath.read_bytes() == CONTENT
+    mtime = filepath.stat().st_mtime_ns
+
+    assert not fetch_file(_get_url(server), filepath, method="POST")
+    assert server.requests[-1]["If-None-Match"] == ETAG
+    assert filepath.stat().st_mtime_ns == mtime
+    assert filepath.read_bytes() == CONTENT
+
+
+def test_fetch_file_resumes_partial_download(server, tmp_path):
+    filepath = tmp_path / "BERPublicsearch.zip"
+    # as left by a download interrupted halfway through
+    partial_filepath = tmp_path / "BERPublicsearch.zip.partial"
+    partial_filepath.write_bytes(CONTENT[: len(CONTENT) // 2])
+    metadata_filepath = tmp_path / "BERPublicsearch.zip.download.json"
+    metadata_filepath.write_text(json.dumps({"partial": {"etag": ETAG}}))
+
+    assert fetch_file(_get_url(server), filepath)
+
+    assert server.requests[-1]["Range"] == f"bytes={len(CONTENT) // 2}-"
+    assert server.requests[-1]["If-Range"] == ETAG
+    # a server which ignores Range sends everything, which replaces the partial
+    assert filepath.read_bytes() == CONTENT
+    assert not partial_filepath.exists()
+    assert json.loads(metadata_filepath.read_text())["size"] == len(CONTENT)
+
+
+def test_fetch_file_restarts_if_partial_download_is_stale(server, tmp_path):
+    filepath = tmp_path / "BERPublicsearch.zip"
+    partial_filepath = tmp_path / "BERPublicsearch.zip.partial"
+    partial_filepath.write_bytes(b"stale" * 1000)
+    metadata_filepath = tmp_path / "BERPublicsearch.zip.download.json"
+    metadata_filepath.write_text(json.dumps({"partial": {"etag": '"v0"'}}))
+
+    assert fetch_file(_get_url(server), filepath)
+
+    assert filepath.read_bytes() == CONTENT
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dtypes import get_bytes_per_value
+from dtypes import merge_profiles
+from dtypes import plan_dtypes
+from dtypes import profile_numbers
+
+# the dtypes declared in pipeline.yaml before these were planned from a profile
+DTYPES = {
+    "year_of_construction": "float32",
+    "living_area_percent": "float32",
+    "no_of_storeys": "float32",
+    "heat_loss_parameter": "float32",
+    "ber_rating": "float32",
+    "empty": "float32",
+}
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(42)
+    n_rows = 10000
+    columns = {
+        "year_of_construction": rng.integers(1700, 2022, n_rows),
+        "living_area_percent": rng.integers(0, 101, n_rows),
+        "no_of_storeys": rng.integers(-1, 5, n_rows),
+        "heat_loss_parameter": rng.gamma(2, 1, n_rows),
+        "ber_rating": rng.integers(0, 2**24, n_rows),
+        "empty": np.full(n_rows, np.nan),
+    }
+    buildings = pd.DataFrame(columns).astype("float32")
+    # some values are missing in every column
+    return buildings.mask(rng.random(buildings.shape) < 0.05)
+
+
+def test_profile_numbers_is_the_same_in_chunks(buildings):
+    expected = profile_numbers(buildings)
+
+    profile = {}
+    for start in range(0, len(buildings), 3000):
+        chunk = buildings.iloc[start : start + 3000]
+        profile = merge_profiles(profile, profile_numbers(chunk))
+
+    assert profile == expected
+
+
+def test_plan_dtypes_holds_the_baseline_values_exactly(buildings):
+    planned_dtypes = plan_dtypes(DTYPES, profile=profile_numbers(buildings))
+
+    planned = buildings.astype(planned_dtypes)
+
+    assert planned_dtypes == {
+        "year_of_construction": "UInt16",
+        "living_area_percent": "UInt8",
+        "no_of_storeys": "Int8",
+        "heat_loss_parameter": "float32",
+        "ber_rating": "float32",
+        "empty": "float32",
+    }
+    pd.testing.assert_frame_equal(planned.astype("float32"), buildings.astype(DTYPES))
+
+
+def test_plan_dtypes_never_widens_a_column(buildings):
+    profile = profile_numbers(buildings)
+
+    planned_dtypes = plan_dtypes(DTYPES, profile=profile)
+
+    for column, dtype in DTYPES.items():
+        has_missing = profile[column]["missing"] > 0
+        assert get_bytes_per_value(
+            planned_dtypes[column], has_missing
+        ) <= get_bytes_per_value(dtype, has_missing)
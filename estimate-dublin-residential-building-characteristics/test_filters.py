@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+import yaml
+
+from filters import compile_conditions
+from filters import profile_conditions
+
+DUBLIN_SMALL_AREA_IDS = ["268000001", "268000002", "268000003"]
+
+# the query of extract_buildings_meeting_conditions before its conditions were
+# declared in pipeline.yaml
+BASELINE_CONDITIONS = [
+    "type_of_rating != 'Provisional    '",
+    "ground_floor_area > 0 and ground_floor_area < 1000",
+    "ground_floor_height > 0",
+    "living_area_percent > 5 or living_area_percent < 90",
+    "main_sh_boiler_efficiency > 19 or main_sh_boiler_efficiency < 600",
+    "main_hw_boiler_efficiency > 19 or main_hw_boiler_efficiency < 320",
+    "main_sh_boiler_efficiency_adjustment_factor > 0.7",
+    "main_hw_boiler_efficiency_adjustment_factor > 0.7",
+    "declared_loss_factor < 20",
+    "thermal_bridging_factor > 0 or thermal_bridging_factor <= 0.15",
+    "small_area in @dublin_small_area_ids",
+]
+
+# a typical value which meets each condition & values either side of & on each
+# threshold
+VALUES = {
+    "ground_floor_area": [80, -1, 0, 1, 999, 1000, 1001],
+    "ground_floor_height": [2.5, -1, 0, 1],
+    "living_area_percent": [30, 4, 5, 6, 89, 90, 91],
+    "main_sh_boiler_efficiency": [85, 18, 19, 20, 599, 600, 601],
+    "main_hw_boiler_efficiency": [85, 18, 19, 20, 319, 320, 321],
+    "main_sh_boiler_efficiency_adjustment_factor": [1, 0.6, 0.7, 0.8],
+    "main_hw_boiler_efficiency_adjustment_factor": [1, 0.6, 0.7, 0.8],
+    "declared_loss_factor": [5, 19, 20, 21],
+    "thermal_bridging_factor": [0.05, -0.1, 0, 0.1, 0.15, 0.2],
+}
+
+
+def _query_baseline(buildings, dublin_small_area_ids):
+    query_str = " and ".join(["(" + c + ")" for c in BASELINE_CONDITIONS])
+    return buildings.query(query_str)
+
+
+def _read_conditions():
+    with open(Path(__file__).parent / "pipeline.yaml", "r") as f:
+        tasks = yaml.safe_load(f)
+    (task,) = [
+        t for t in tasks if t["source"] == "tasks.save_selected_columns_as_parquet"
+    ]
+    return task["params"]["conditions"]
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(42)
+    n_rows = 20000
+    # most values are typical so that some buildings meet every condition
+    columns = {
+        column: np.where(
+            rng.random(n_rows) < 0.8,
+            values[0],
+            rng.choice(values[1:] + [np.nan], size=n_rows),
+        ).astype("float32")
+        for column, values in VALUES.items()
+    }
+    return pd.DataFrame(
+        {
+            "small_area": rng.choice(DUBLIN_SMALL_AREA_IDS + ["017000001"], n_rows),
+            "type_of_rating": pd.Categorical(
+                rng.choice(["Final", "Provisional    ", "Existing", None], n_rows)
+            ),
+            **columns,
+        }
+    )
+
+
+def test_compile_conditions_keeps_the_rows_of_the_baseline_query(buildings):
+    expected = _query_baseline(buildings, DUBLIN_SMALL_AREA_IDS).index
+    conditions = _read_conditions() + [["small_area", "in", DUBLIN_SMALL_AREA_IDS]]
+    table = pa.Table.from_pandas(buildings, preserve_index=False)
+
+    filter_expression = compile_conditions(conditions, schema=table.schema)
+    scanned = ds.dataset(table).to_table(filter=filter_expression)
+    mask = compile_conditions(conditions, schema=table.schema, field=table.column)
+
+    assert scanned.to_pandas().equals(buildings.loc[expected].reset_index(drop=True))
+    kept = np.flatnonzero(mask.fill_null(False).to_numpy(zero_copy_only=False))
+    assert kept.tolist() == expected.tolist()
+
+
+def test_profile_conditions_counts_the_rows_of_the_baseline_query(buildings):
+    expected = _query_baseline(buildings, DUBLIN_SMALL_AREA_IDS)
+    conditions = _read_conditions() + [["small_area", "in", DUBLIN_SMALL_AREA_IDS]]
+    table = pa.Table.from_pandas(buildings, preserve_index=False)
+
+    rejections = profile_conditions(conditions, batches=table.to_batches(5000))
+
+    assert rejections["total"] == len(buildings)
+    assert rejections["remaining"] == len(expected)
@@ -0,0 +1,85 @@
+from zipfile import ZIP_DEFLATED
+from zipfile import ZipFile
+
+import pandas as pd
+import pytest
+
+from helper import read_bers
+
+USECOLS = ["SA_Code", "CountyName", "DwellingTypeDescr", "GroundFloorArea", "NoStoreys"]
+DTYPE = {
+    "SA_Code": "category",
+    "CountyName": "category",
+    "DwellingTypeDescr": "category",
+    "GroundFloorArea": "float32",
+    "NoStoreys": "float32",
+}
+
+
+def _write_bers(filepath, n_rows):
+    # latin-1 text, unbalanced quotes which are read as text & missing values
+    counties = ["Co. Dublin", "Dublin 6W", "Co. Dún Laoghaire", ""]
+    dwellings = ['Mid-terrace "house', "Apartment", "Semi-detached house", ""]
+    lines = ["\t".join(USECOLS + ["BerRating"])]
+    for i in range(n_rows):
+        lines.append(
+            "\t".join(
+                [
+                    f"268{i % 97:06d}" if i % 13 else "",
+                    counties[i % len(counties)],
+                    dwellings[i % len(dwellings)],
+                    f"{(i % 211) * 0.5:.2f}" if i % 17 else "",
+                    str(i % 4),
+                    str(i),
+                ]
+            )
+        )
+    with ZipFile(filepath, "w", compression=ZIP_DEFLATED) as zf:
+        zf.writestr(
+            "BERPublicsearch.txt", ("\r\n".join(lines) + "\r\n").encode("latin-1")
+        )
+
+
+@pytest.fixture
+def filepath(tmp_path):
+    filepath = tmp_path / "BERPublicsearch.zip"
+    _write_bers(filepath, n_rows=5000)
+    return filepath
+
+
+def _get_sidecar_filepaths(filepath):
+    return list(filepath.parent.glob("BERPublicsearch-*.parquet"))
+
+
+def test_read_bers_via_arrow_reads_as_pandas(filepath):
+    expected = read_bers(filepath, how="pandas", usecols=USECOLS, dtype=DTYPE)
+
+    bers = read_bers(filepath, how="arrow", usecols=USECOLS, dtype=DTYPE)
+
+    pd.testing.assert_frame_equal(
+        bers[expected.columns], expected, check_categorical=False
+    )
+    for column in ["SA_Code", "CountyName", "DwellingTypeDescr"]:
+        assert set(bers[column].cat.categories) == set(expected[column].cat.categories)
+
+
+def test_read_bers_via_arrow_reuses_its_sidecar(filepath):
+    bers = read_bers(filepath, how="arrow", usecols=USECOLS, dtype=DTYPE)
+    (sidecar_filepath,) = _get_sidecar_filepaths(filepath)
+    modified_time = sidecar_filepath.stat().st_mtime_ns
+
+    cached_bers = read_bers(filepath, how="arrow", usecols=USECOLS, dtype=DTYPE)
+
+    assert _get_sidecar_filepaths(filepath) == [sidecar_filepath]
+    assert sidecar_filepath.stat().st_mtime_ns == modified_time
+    pd.testing.assert_frame_equal(cached_bers, bers)
+
+
+def test_read_bers_via_arrow_rereads_a_changed_export(filepath):
+    read_bers(filepath, how="arrow", usecols=USECOLS, dtype=DTYPE)
+    _write_bers(filepath, n_rows=4000)
+
+    bers = read_bers(filepath, how="arrow", usecols=USECOLS, dtype=DTYPE)
+
+    assert len(bers) == 4000
+    assert len(_get_sidecar_filepaths(filepath)) == 2
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incremental import get_changed_groups
+from incremental import hash_grouped_rows
+from incremental import is_in_groups
+from incremental import patch_groups
+
+ON = ["small_area", "period_built"]
+
+
+def _aggregate(buildings):
+    return buildings.groupby(ON, as_index=False)["energy_value"].median()
+
+
+def _sort(df):
+    return df.sort_values(ON, ignore_index=True)
+
+
+@pytest.fixture
+def previous():
+    rng = np.random.default_rng(42)
+    n_rows = 20000
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in rng.integers(0, 500, n_rows)],
+            "period_built": rng.choice(["PRE19", "71_80", "01_10"], n_rows),
+            "energy_value": rng.gamma(2, 100, n_rows).astype("float32"),
+        }
+    )
+
+
+def _get_swapped(buildings):
+    # two buildings of one group, whose order decides their matches
+    is_in_group = (buildings["small_area"] == "268000007") & (
+        buildings["period_built"] == "PRE19"
+    )
+    return buildings.index[is_in_group][:2]
+
+
+@pytest.fixture
+def current(previous):
+    # a refresh edits, removes, adds & reorders a few buildings
+    current = previous.copy()
+    energy_values = current["energy_value"].to_numpy().copy()
+    energy_values[:10] += 1
+    current["energy_value"] = energy_values
+    swapped = _get_swapped(current)
+    current.loc[swapped[::-1]] = current.loc[swapped].to_numpy()
+    added = previous.iloc[20:25].assign(small_area="268999999")
+    current = pd.concat([current.drop(index=range(10, 20)), added])
+    return current.reset_index(drop=True)
+
+
+def _get_changed_groups(previous, current):
+    return get_changed_groups(
+        hash_grouped_rows(previous, on=ON), hash_grouped_rows(current, on=ON), on=ON
+    )
+
+
+def test_get_changed_groups_finds_only_the_groups_of_changed_rows(previous, current):
+    edited = previous.iloc[:20]
+    swapped = previous.loc[_get_swapped(previous)]
+    added = current[current["small_area"] == "268999999"]
+    expected = pd.concat([edited[ON], swapped[ON], added[ON]]).drop_duplicates()
+
+    changed_groups = _get_changed_groups(previous, current)
+
+    pd.testing.assert_frame_equal(_sort(changed_groups), _sort(expected))
+    assert len(_get_changed_groups(previous, previous)) == 0
+
+
+def test_patch_groups_equals_a_full_recompute(previous, current):
+    changed_groups = _get_changed_groups(previous, current)
+    recomputed = _aggregate(current[is_in_groups(current, changed_groups, on=ON)])
+
+    patched = patch_groups(_aggregate(previous), recomputed, changed_groups, on=ON)
+
+    pd.testing.assert_frame_equal(_sort(patched), _sort(_aggregate(current)))
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from matching import encode_groups
+from matching import get_group_ordinals
+from matching import match_within_groups
+
+MERGE_COLUMNS = ["small_area", "period_built"]
+PERIODS_BUILT = ["PRE19", "19_45", "46_60", "61_70", "71_80", "81_90", "91_00"]
+
+
+def _merge_baseline(census, bers):
+    # the merge of fill_census_with_bers before matching was vectorised, BERs are
+    # numbered before those built since 2016 are left out
+    census = census.copy()
+    bers = bers.copy()
+    census["id"] = census.groupby(MERGE_COLUMNS).cumcount().apply(lambda x: x + 1)
+    bers["id"] = bers.groupby(MERGE_COLUMNS).cumcount().apply(lambda x: x + 1)
+    return census.merge(
+        bers.query("year_of_construction < 2016"),
+        on=["small_area", "period_built", "id"],
+        how="left",
+    )
+
+
+@pytest.fixture
+def census():
+    rng = np.random.default_rng(42)
+    n_rows = 20000
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in rng.integers(0, 300, n_rows)],
+            "period_built": rng.choice(PERIODS_BUILT, n_rows),
+        }
+    )
+
+
+@pytest.fixture
+def bers():
+    rng = np.random.default_rng(0)
+    n_rows = 15000
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in rng.integers(0, 330, n_rows)],
+            "period_built": rng.choice(PERIODS_BUILT + [None], n_rows),
+            "year_of_construction": rng.choice(
+                [1950.0, 2010.0, 2018.0, np.nan], n_rows
+            ),
+            "energy_value": rng.gamma(2, 100, n_rows),
+        }
+    )
+
+
+def _match(census, bers):
+    (census_groups, ber_groups), _ = encode_groups([census, bers], on=MERGE_COLUMNS)
+    _, _, indexer = match_within_groups(
+        census_groups,
+        ber_groups,
+        right_is_candidate=(bers["year_of_construction"] < 2016).to_numpy(),
+    )
+    return indexer
+
+
+def test_get_group_ordinals_numbers_rows_as_cumcount(census):
+    (groups,), _ = encode_groups([census], on=MERGE_COLUMNS)
+
+    expected = census.groupby(MERGE_COLUMNS).cumcount() + 1
+
+    assert get_group_ordinals(groups).tolist() == expected.tolist()
+
+
+def test_match_within_groups_matches_the_baseline_merge(census, bers):
+    expected = _merge_baseline(census, bers)
+
+    indexer = _match(census, bers)
+
+    is_found = indexer != -1
+    energy_values = np.full(len(census), np.nan)
+    energy_values[is_found] = bers["energy_value"].to_numpy()[indexer[is_found]]
+    np.testing.assert_array_equal(energy_values, expected["energy_value"])
+
+
+def test_match_within_groups_matches_on_shared_categories(census, bers):
+    expected = _match(census, bers)
+    categories = pd.Index(sorted(set(census["small_area"]) | set(bers["small_area"])))
+    census = census.astype({"small_area": pd.CategoricalDtype(categories)})
+    bers = bers.astype({"small_area": pd.CategoricalDtype(categories)})
+
+    indexer = _match(census, bers)
+
+    np.testing.assert_array_equal(indexer, expected)
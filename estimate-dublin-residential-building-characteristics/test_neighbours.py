@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial import cKDTree
+
+from neighbours import encode_neighbour_values
+from neighbours import impute_from_neighbours
+from neighbours import standardise_features
+
+COLUMNS = ["main_sh_boiler_fuel", "dwelling_type", "energy_value"]
+FUELS = ["Heating Oil", "Mains Gas", "Electricity"]
+
+
+@pytest.fixture
+def observed():
+    rng = np.random.default_rng(42)
+    n_rows = 2000
+    energy_values = rng.gamma(2, 100, size=n_rows).astype("float32")
+    energy_values[rng.random(n_rows) < 0.2] = np.nan
+    return pd.DataFrame(
+        {
+            "x": rng.normal(700000, 5000, size=n_rows),
+            "y": rng.normal(735000, 5000, size=n_rows),
+            "period_built": rng.integers(0, 10, size=n_rows).astype("float64"),
+            "main_sh_boiler_fuel": pd.Categorical(
+                rng.choice(FUELS + [None], size=n_rows), categories=FUELS
+            ),
+            "dwelling_type": rng.choice(["Apartment", "House", None], size=n_rows),
+            "energy_value": energy_values,
+        }
+    )
+
+
+@pytest.fixture
+def queries():
+    rng = np.random.default_rng(0)
+    n_rows = 300
+    return np.column_stack(
+        [
+            rng.normal(700000, 5000, size=n_rows),
+            rng.normal(735000, 5000, size=n_rows),
+            rng.integers(0, 10, size=n_rows),
+        ]
+    )
+
+
+def _get_mode_or_first_occurence(srs):
+    m = pd.Series.mode(srs)
+    return m.values[0] if not m.empty else np.nan
+
+
+def _impute_baseline(observed, queries, k):
+    # the k nearest buildings by brute force, aggregated as create_archetypes
+    # aggregates the buildings of an archetype
+    features, queries = standardise_features(
+        observed[["x", "y", "period_built"]].to_numpy(), queries
+    )
+    distances = ((queries[:, None, :] - features[None, :, :]) ** 2).sum(axis=2)
+    nearest = np.argsort(distances, axis=1)[:, :k]
+    return pd.DataFrame(
+        [
+            {
+                "main_sh_boiler_fuel": _get_mode_or_first_occurence(
+                    observed["main_sh_boiler_fuel"].iloc[n]
+                ),
+                "dwelling_type": _get_mode_or_first_occurence(
+                    observed["dwelling_type"].iloc[n]
+                ),
+                "energy_value": observed["energy_value"].iloc[n].median(),
+            }
+            for n in nearest
+        ]
+    ).astype({"energy_value": "float32"})
+
+
+def _impute(observed, queries, k):
+    features, queries = standardise_features(
+        observed[["x", "y", "period_built"]].to_numpy(), queries
+    )
+    values = encode_neighbour_values(observed, columns=COLUMNS)
+    return impute_from_neighbours(queries, tree=cKDTree(features), values=values, k=k)
+
+
+# some buildings have no neighbours with known values
+@pytest.mark.filterwarnings("ignore:Mean of empty slice")
+@pytest.mark.parametrize("k", [1, 4, 7])
+def test_impute_from_neighbours_aggregates_as_the_baseline(observed, queries, k):
+    expected = _impute_baseline(observed, queries, k=k)
+
+    imputed = _impute(observed, queries, k=k)
+
+    pd.testing.assert_frame_equal(imputed, expected)
+
+
+def test_impute_from_neighbours_rejects_no_neighbours(observed, queries):
+    with pytest.raises(ValueError):
+        _impute(observed, queries, k=0)
@@ -1,6 +1,7 @@
 import re
 from typing import Any
 
+from codema_dev_shared.modes import groupby_mode
 import numpy as np
 import pandas as pd
 
@@ -54,10 +55,10 @@ def replace_not_stated_period_built_with_mode(
     product: Any, upstream: Any,
 ) -> None:
     buildings = pd.read_csv(upstream["melt_small_area_period_built_to_individual_buildings"])
-    modal_period_built = (
-        buildings.assign(period_built=lambda df: df["period_built"].replace({"NS": np.nan}))
-        .groupby("small_area")["period_built"]
-        .transform(lambda s: s.mode()[0])
+    modal_period_built = buildings["small_area"].map(
+        groupby_mode(
+            buildings["period_built"].replace({"NS": np.nan}), by=buildings["small_area"]
+        )
     )
     buildings["period_built"] = buildings["period_built"].replace({"NS": np.nan}).fillna(modal_period_built)
     buildings.to_csv(product, index=False)
\ No newline at end of file
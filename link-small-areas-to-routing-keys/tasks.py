@@ -1,6 +1,7 @@
 import json
 from typing import Any
 
+from codema_dev_shared.small_area_keys import build_small_area_keys
 import geopandas as gpd
 import pandas as pd
 
@@ -121,13 +122,25 @@ def link_small_areas_to_routing_keys(
 def extract_small_area_countyname_map(
     product: Any,
     upstream: Any,
+) -> None:
+    # the keys are read rather than the boundaries as they carry no geometries
+    small_area_keys = pd.read_parquet(
+        upstream["create_small_area_keys"], columns=["small_area", "postcode"]
+    )
+    small_area_keys.set_index("small_area")["postcode"].rename("countyname").to_json(
+        product
+    )
+
+
+def create_small_area_keys(
+    product: Any,
+    upstream: Any,
 ) -> None:
     small_areas_in_routing_keys = gpd.read_file(
-        str(upstream["link_small_areas_to_routing_keys"]), driver="GPKG"
+        str(upstream["link_small_areas_to_routing_keys"]), ignore_geometry=True
     )
-    columns = (
-        small_areas_in_routing_keys[["small_area", "countyname"]]
-        .set_index("small_area")
-        .squeeze()
+    small_areas = small_areas_in_routing_keys.rename(
+        columns={"csoed": "cso_ed_id", "countyname": "postcode"}
     )
-    columns.to_json(product)
+    small_area_keys = build_small_area_keys(small_areas)
+    small_area_keys.to_parquet(product)
@@ -0,0 +1,98 @@
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# pd.Series.mode per group is a python call per group, these work on integer codes
+# instead & keep its conventions: ties resolve to the first value in sorted (or
+# category) order and groups without any values have no mode
+
+MAX_DENSE_COUNTS = 2**24
+
+
+def get_value_codes(values: pd.Series) -> Tuple[np.ndarray, Any]:
+    # -1 flags a missing value
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype("int64"), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values, sort=True)
+        return codes.astype("int64"), uniques
+
+
+def _get_dense_modal_codes(
+    keys: np.ndarray,
+    weights: Optional[np.ndarray],
+    n_groups: int,
+    n_codes: int,
+) -> np.ndarray:
+    counts = np.bincount(keys, weights=weights, minlength=n_groups * n_codes)
+    counts = counts.reshape(n_groups, n_codes)
+    modal_codes = counts.argmax(axis=1)
+    modal_codes[counts.max(axis=1) == 0] = -1
+    return modal_codes
+
+
+def _get_sparse_modal_codes(
+    keys: np.ndarray,
+    weights: Optional[np.ndarray],
+    n_groups: int,
+    n_codes: int,
+) -> np.ndarray:
+    pairs, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=weights)
+    pair_groups = pairs // n_codes
+    pair_codes = pairs % n_codes
+
+    # pairs are sorted by (group, code) so the first maximum is the smallest code
+    group_starts = np.flatnonzero(np.diff(pair_groups, prepend=-1))
+    max_counts = np.maximum.reduceat(counts, group_starts)
+    run_lengths = np.diff(group_starts, append=len(pairs))
+    is_max = counts == np.repeat(max_counts, run_lengths)
+    modal_groups, first_max = np.unique(pair_groups[is_max], return_index=True)
+
+    modal_codes = np.full(n_groups, -1, dtype="int64")
+    modal_codes[modal_groups] = pair_codes[is_max][first_max]
+    return modal_codes
+
+
+def get_grouped_modal_codes(
+    groups: np.ndarray,
+    codes: np.ndarray,
+    n_groups: int,
+    n_codes: int,
+    weights: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    is_known = (groups != -1) & (codes != -1)
+    if n_codes == 0 or not is_known.any():
+        return np.full(n_groups, -1, dtype="int64")
+
+    keys = groups[is_known].astype("int64") * n_codes + codes[is_known]
+    if weights is not None:
+        weights = weights[is_known]
+
+    # a dense count matrix is fastest but is (groups x codes) in size
+    if n_groups * n_codes <= MAX_DENSE_COUNTS:
+        return _get_dense_modal_codes(keys, weights, n_groups, n_codes)
+    else:
+        return _get_sparse_modal_codes(keys, weights, n_groups, n_codes)
+
+
+def decode_modal_codes(modal_codes: np.ndarray, uniques: Any) -> np.ndarray:
+    modes = np.asarray(uniques, dtype="object").take(modal_codes)
+    modes[modal_codes == -1] = np.nan
+    return modes
+
+
+def groupby_mode(values: pd.Series, by: pd.Series) -> pd.Series:
+    groups, group_uniques = pd.factorize(by, sort=True)
+    codes, uniques = get_value_codes(values)
+    modal_codes = get_grouped_modal_codes(
+        groups, codes=codes, n_groups=len(group_uniques), n_codes=len(uniques)
+    )
+    return pd.Series(
+        decode_modal_codes(modal_codes, uniques),
+        index=pd.Index(group_uniques, name=by.name),
+        name=values.name,
+    )
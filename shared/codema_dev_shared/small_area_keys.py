@@ -0,0 +1,70 @@
+from typing import Iterable
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Small area ids are strings like 268001001/01, so pipelines join & group on
+# int32 codes instead & only decode them back to ids at their boundaries.  A
+# small area's code is its position in the sorted ids, so codes are stable for as
+# long as the CSO boundaries are, & each row carries the codes of its parents
+
+PARENT_LEVELS = ["cso_ed_id", "local_authority", "postcode"]
+
+
+def build_small_area_keys(
+    small_areas: pd.DataFrame, parent_levels: List[str] = PARENT_LEVELS
+) -> pd.DataFrame:
+    keys = small_areas.drop_duplicates("small_area").sort_values(
+        "small_area", ignore_index=True
+    )
+    keys["small_area_code"] = np.arange(len(keys), dtype="int32")
+    for level in parent_levels:
+        # missing parents are coded -1
+        codes, _ = pd.factorize(keys[level], sort=True)
+        keys[f"{level}_code"] = codes.astype("int32")
+    return keys[
+        ["small_area", "small_area_code"]
+        + [c for level in parent_levels for c in [level, f"{level}_code"]]
+    ]
+
+
+def _get_level_names(keys: pd.DataFrame, level: str) -> pd.Index:
+    # codes are positions in the sorted names of a level
+    return pd.Index(np.sort(keys[level].dropna().unique()))
+
+
+def encode_small_areas(small_areas: Iterable[str], keys: pd.DataFrame) -> np.ndarray:
+    # unknown small areas are coded -1
+    names = _get_level_names(keys, "small_area")
+    if isinstance(getattr(small_areas, "dtype", None), pd.CategoricalDtype):
+        # only the categories are looked up, a missing value's code of -1 takes the
+        # appended -1
+        category_codes = names.get_indexer(small_areas.cat.categories)
+        return np.append(category_codes, -1)[small_areas.cat.codes].astype("int32")
+    return names.get_indexer(pd.Index(small_areas, dtype="object")).astype("int32")
+
+
+def decode_small_areas(codes: np.ndarray, keys: pd.DataFrame) -> pd.Series:
+    return pd.Series(
+        pd.Categorical.from_codes(
+            codes, categories=_get_level_names(keys, "small_area")
+        ),
+        name="small_area",
+    )
+
+
+def get_parent_codes(codes: np.ndarray, keys: pd.DataFrame, level: str) -> np.ndarray:
+    parent_codes = keys[f"{level}_code"].to_numpy()
+    return np.where(codes == -1, -1, parent_codes[codes]).astype("int32")
+
+
+def decode_parent_codes(
+    parent_codes: np.ndarray, keys: pd.DataFrame, level: str
+) -> pd.Series:
+    return pd.Series(
+        pd.Categorical.from_codes(
+            parent_codes, categories=_get_level_names(keys, level)
+        ),
+        name=level,
+    )
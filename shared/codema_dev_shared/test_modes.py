@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codema_dev_shared import modes
+from codema_dev_shared.modes import get_grouped_modal_codes
+from codema_dev_shared.modes import groupby_mode
+
+FUELS = ["Mains Gas", "Heating Oil", "Electricity", "Wood"]
+
+
+def _get_mode_or_first_occurence(srs):
+    # the aggregation of create_archetypes before modes were vectorised
+    m = pd.Series.mode(srs)
+    return m.values[0] if not m.empty else np.nan
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(42)
+    n_rows = 20000
+    # few values per group so that many groups have tied modes, & some groups only
+    # have missing values
+    small_areas = rng.integers(0, 2000, size=n_rows)
+    fuels = rng.choice(FUELS[:3] + [None], size=n_rows)
+    fuels[small_areas < 20] = None
+    return pd.DataFrame(
+        {
+            "small_area": [f"268{i:06d}" for i in small_areas],
+            "fuel": fuels,
+        }
+    )
+
+
+@pytest.fixture(params=["dense", "sparse"])
+def counts(request, monkeypatch):
+    if request.param == "sparse":
+        monkeypatch.setattr(modes, "MAX_DENSE_COUNTS", 0)
+    return request.param
+
+
+def test_groupby_mode_finds_the_baseline_mode_of_strings(buildings, counts):
+    expected = buildings.groupby("small_area")["fuel"].agg(_get_mode_or_first_occurence)
+
+    result = groupby_mode(buildings["fuel"], by=buildings["small_area"])
+
+    pd.testing.assert_series_equal(result, expected, check_dtype=False)
+
+
+def test_groupby_mode_finds_the_baseline_mode_of_categories(buildings, counts):
+    # ties resolve to the first category, which is neither the first in sorted
+    # order nor the first to appear
+    fuels = pd.Categorical(buildings["fuel"], categories=FUELS[::-1])
+    buildings = buildings.assign(fuel=fuels)
+    expected = buildings.groupby("small_area")["fuel"].agg(_get_mode_or_first_occurence)
+
+    result = groupby_mode(buildings["fuel"], by=buildings["small_area"])
+
+    pd.testing.assert_series_equal(result, expected.astype("object"))
+
+
+def test_get_grouped_modal_codes_is_the_same_dense_or_sparse(buildings, monkeypatch):
+    rng = np.random.default_rng(0)
+    groups, group_uniques = pd.factorize(buildings["small_area"])
+    codes, uniques = pd.factorize(buildings["fuel"])
+    weights = rng.integers(1, 4, size=len(buildings)).astype("float64")
+    kwargs = dict(
+        codes=codes, n_groups=len(group_uniques), n_codes=len(uniques), weights=weights
+    )
+
+    dense = get_grouped_modal_codes(groups, **kwargs)
+    monkeypatch.setattr(modes, "MAX_DENSE_COUNTS", 0)
+    sparse = get_grouped_modal_codes(groups, **kwargs)
+
+    np.testing.assert_array_equal(dense, sparse)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codema_dev_shared.small_area_keys import build_small_area_keys
+from codema_dev_shared.small_area_keys import decode_parent_codes
+from codema_dev_shared.small_area_keys import decode_small_areas
+from codema_dev_shared.small_area_keys import encode_small_areas
+from codema_dev_shared.small_area_keys import get_parent_codes
+
+
+@pytest.fixture
+def small_areas():
+    rng = np.random.default_rng(42)
+    n_small_areas = 500
+    ids = [f"268{i:06d}" for i in rng.permutation(n_small_areas)]
+    postcodes = rng.choice(["Dublin 1", "Dublin 6W", "Co. Dublin", None], n_small_areas)
+    return pd.DataFrame(
+        {
+            "small_area": ids,
+            "cso_ed_id": [f"{int(i) // 15:05d}" for i in ids],
+            "local_authority": rng.choice(["Dublin City", "Fingal"], n_small_areas),
+            "postcode": postcodes,
+        }
+    )
+
+
+@pytest.fixture
+def buildings(small_areas):
+    # buildings in known, unknown & missing small areas
+    rng = np.random.default_rng(0)
+    ids = small_areas["small_area"].tolist() + ["017000001", None]
+    return pd.Series(rng.choice(ids, 5000), name="small_area")
+
+
+def test_decode_small_areas_round_trips_known_small_areas(small_areas, buildings):
+    keys = build_small_area_keys(small_areas)
+    is_known = buildings.isin(small_areas["small_area"])
+
+    codes = encode_small_areas(buildings, keys=keys)
+
+    decoded = decode_small_areas(codes, keys=keys)
+    assert (codes[~is_known] == -1).all()
+    assert decoded[is_known].astype("object").equals(buildings[is_known])
+    assert decoded[~is_known].isna().all()
+
+
+def test_encode_small_areas_is_the_same_for_categories(small_areas, buildings):
+    keys = build_small_area_keys(small_areas)
+    expected = encode_small_areas(buildings, keys=keys)
+
+    codes = encode_small_areas(buildings.astype("category"), keys=keys)
+
+    np.testing.assert_array_equal(codes, expected)
+
+
+@pytest.mark.parametrize("level", ["cso_ed_id", "local_authority", "postcode"])
+def test_decode_parent_codes_finds_the_parents_of_a_merge(
+    small_areas, buildings, level
+):
+    # the merge which linked buildings to their parents before small areas were coded
+    merged = buildings.to_frame().merge(small_areas, on="small_area", how="left")
+    keys = build_small_area_keys(small_areas)
+    codes = encode_small_areas(buildings, keys=keys)
+
+    parent_codes = get_parent_codes(codes, keys=keys, level=level)
+
+    parents = decode_parent_codes(parent_codes, keys=keys, level=level)
+    pd.testing.assert_series_equal(
+        parents.astype("string"), merged[level].astype("string"), check_names=False
+    )
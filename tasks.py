@@ -20,5 +20,7 @@ def merge_environment_ymls(c):
         "conda-merge "
         + environment_yml_paths
         + " " + str(cwd / "environment.meta.yml")
+        # projects install the shared helpers relative to themselves
+        + " | sed 's#-e ../shared#-e ./shared#'"
         + " > environment.yml"
     )